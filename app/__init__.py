@@ -1,23 +1,38 @@
 import os
-from flask import Flask
-from flask_cors import CORS
-from .database import engine, Base
-from .routes import api_bp, pages_bp
+
+_app = None
 
 
 def create_app():
+    from flask import Flask
+    from flask_cors import CORS
+    from .database import DB_PATH, engine, Base, migrate_schema
+    from .jobs import recover_jobs
+    from .routes import api_bp, pages_bp
+
+    os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
     app = Flask(__name__)
     CORS(app)
     app.config["JSON_AS_ASCII"] = False
     Base.metadata.create_all(bind=engine)
+    migrate_schema()
+    recover_jobs()
     app.register_blueprint(api_bp, url_prefix="/api")
     app.register_blueprint(pages_bp)
     return app
 
 
-app = create_app()
+def __getattr__(name):
+    # the WSGI app is built on first access, so importing app.optimizer from benchmarks or pool workers
+    # neither opens the database nor starts the job executor
+    global _app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        _app = create_app()
+    return _app
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    create_app().run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,222 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .matrix import POOL_CONTEXT, SharedArrays, TravelMatrix
+from .metrics import observe, timer
+from .optimizer import CVRPTWOptimizer
+from .parallel import attach_matrix, shared_matrix
+from .solver import Problem, SolveOptions, load_problem, locate_route, serialize_route, serialize_unassigned
+from .traffic import get_speed_profile, time_buckets
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", str(os.cpu_count() or 1)))
+MAX_SCENARIOS = 32
+# the union matrix is built once, so every scenario has to agree on how costs are computed
+MATRIX_OPTIONS = ("costs", "speed_kmh", "matrix_file", "time_dependent", "shift_start")
+
+_batch_matrix: Optional[TravelMatrix] = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    problem: Problem
+    options: SolveOptions
+
+
+def load_batch(session, payload: Dict) -> Tuple[Optional[List[Scenario]], Optional[str]]:
+    scenarios = payload.get("scenarios")
+    if not isinstance(scenarios, list) or not scenarios:
+        return None, "scenarios must be a non-empty list"
+    if len(scenarios) > MAX_SCENARIOS:
+        return None, f"at most {MAX_SCENARIOS} scenarios per batch"
+    base = {key: value for key, value in payload.items() if key != "scenarios"}
+    loaded = []
+    for index, scenario in enumerate(scenarios):
+        merged = {**base, **scenario}
+        try:
+            options = SolveOptions.from_payload(merged)
+        except ValueError as exc:
+            return None, f"scenario {index + 1}: {exc}"
+        if options.warm_start:
+            return None, f"scenario {index + 1}: warm_start is not available in a batch"
+        problem, error = load_problem(session, merged, options)
+        if error:
+            return None, f"scenario {index + 1}: {error}"
+        loaded.append(Scenario(name=str(scenario.get("name") or f"scenario {index + 1}"), problem=problem, options=options))
+    first = loaded[0].options
+    if any(getattr(s.options, key) != getattr(first, key) for s in loaded for key in MATRIX_OPTIONS):
+        return None, f"scenarios must share {', '.join(MATRIX_OPTIONS)}"
+    return loaded, None
+
+
+def union_points(scenarios: List[Scenario]):
+    rows: Dict[Tuple[float, float], int] = {}
+    points: List[Tuple[float, float]] = []
+    node_ids: List[Optional[int]] = []
+    indexes = []
+
+    def row(point, node_id) -> int:
+        if point not in rows:
+            rows[point] = len(points)
+            points.append(point)
+            node_ids.append(node_id)
+        return rows[point]
+
+    for scenario in scenarios:
+        problem = scenario.problem
+        nodes = problem.node_ids or [None] * (len(problem.requests) + 1)
+        depot_row = row(tuple(problem.depot), nodes[0])
+        request_rows = [row(tuple(r.location), node) for r, node in zip(problem.requests, nodes[1:])]
+        indexes.append((depot_row, np.array(request_rows, dtype=np.int64)))
+    return points, node_ids if scenarios[0].problem.node_ids is not None else None, indexes
+
+
+def scenario_task(scenario: Scenario, depot_row: int, rows: np.ndarray) -> Dict:
+    problem = scenario.problem
+    options = scenario.options
+    return {
+        "depot": problem.depot,
+        "requests": problem.requests,
+        "vehicles": problem.vehicles,
+        "depot_index": depot_row,
+        "matrix_index": rows,
+        "iterations": options.iterations,
+        "time_limit": options.time_limit,
+        "neighbours": options.neighbours,
+        "decompose": options.decompose,
+        "cluster_size": options.cluster_size,
+    }
+
+
+def solve_scenario(matrix: TravelMatrix, task: Dict) -> Dict:
+    optimizer = CVRPTWOptimizer(
+        depot=task["depot"],
+        requests=task["requests"],
+        vehicles=task["vehicles"],
+        matrix=matrix,
+        matrix_index=task["matrix_index"],
+        depot_index=task["depot_index"],
+        neighbours=task["neighbours"],
+    )
+    routes = optimizer.optimize(
+        iterations=task["iterations"],
+        time_limit=task["time_limit"],
+        decompose=task["decompose"],
+        cluster_size=task["cluster_size"],
+    )
+    return {
+        "routes": [serialize_route(route) for route in routes],
+        "rows": [list(route.rows) for route in routes],
+        "unplaced": optimizer.unplaced,
+        "cost": optimizer.best_cost,
+        "iterations": optimizer.iterations_done,
+        "timings": optimizer.timings,
+        "operators": [
+            (name, "destroy" if name in optimizer.destroy_operators else "repair", op.calls, op.seconds)
+            for name, op in optimizer.operator_stats.items()
+        ],
+    }
+
+
+def _init_batch(spec, clock_start):
+    global _batch_matrix
+    _batch_matrix = attach_matrix(spec, clock_start)
+
+
+def _scenario_worker(task: Dict) -> Dict:
+    return solve_scenario(_batch_matrix, task)
+
+
+def scenario_summary(scenario: Scenario, result: Dict) -> Dict:
+    used = [route for route in result["routes"] if route["stops"]]
+    return {
+        "name": scenario.name,
+        "status": "done",
+        "depot": {"latitude": scenario.problem.depot[0], "longitude": scenario.problem.depot[1]},
+        "vehicles": len(scenario.problem.vehicles),
+        "vehicles_used": len(used),
+        "distance_km": sum(route["distance_km"] for route in used),
+        "travel_time_min": sum(route["travel_time_min"] for route in used),
+        "unassigned": len(result["unplaced"]),
+        "cost": result["cost"],
+        "iterations": result["iterations"],
+    }
+
+
+def solve_batch(
+    scenarios: List[Scenario],
+    options: SolveOptions,
+    progress: Optional[Callable[[int, float], bool]] = None,
+) -> Dict:
+    points, node_ids, indexes = union_points(scenarios)
+    first = scenarios[0].options
+    with timer("cost_matrix", provider=first.costs) as matrix_timing:
+        matrix = first.cost_provider().matrix(points, node_ids, first.matrix_workers)
+    timings = {"matrix": matrix_timing.seconds}
+    if first.time_dependent:
+        with timer("time_buckets") as buckets_timing:
+            matrix = replace(matrix, buckets=time_buckets(matrix, get_speed_profile(), first.shift_start * 3600, first.matrix_workers))
+        timings["time_buckets"] = buckets_timing.seconds
+    tasks = [scenario_task(scenario, depot_row, rows) for scenario, (depot_row, rows) in zip(scenarios, indexes)]
+    results: List[Optional[Dict]] = [None] * len(tasks)
+    workers = max(1, min(BATCH_WORKERS, len(tasks)))
+    iterations = 0
+    with timer("batch") as solve_timing:
+        if workers == 1:
+            for index, task in enumerate(tasks):
+                results[index] = solve_scenario(matrix, task)
+                iterations += results[index]["iterations"]
+                if progress is not None and progress(iterations, results[index]["cost"]) is False:
+                    break
+        else:
+            arrays, clock_start = shared_matrix(matrix)
+            with SharedArrays(arrays) as spec:
+                with ProcessPoolExecutor(
+                    max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_batch, initargs=(spec, clock_start)
+                ) as pool:
+                    futures = {pool.submit(_scenario_worker, task): index for index, task in enumerate(tasks)}
+                    for future in as_completed(futures):
+                        index = futures[future]
+                        results[index] = future.result()
+                        iterations += results[index]["iterations"]
+                        # worker processes keep their own registry, so their operator timings are replayed here
+                        for name, kind, calls, seconds in results[index]["operators"]:
+                            if calls:
+                                observe("operator", seconds, count=calls, operator=name, kind=kind)
+                        if progress is not None and progress(iterations, results[index]["cost"]) is False:
+                            for pending in futures:
+                                pending.cancel()
+                            break
+    timings["solve"] = solve_timing.seconds
+    summary = []
+    details = []
+    for scenario, result in zip(scenarios, results):
+        if result is None:
+            summary.append({"name": scenario.name, "status": "cancelled"})
+            continue
+        summary.append(scenario_summary(scenario, result))
+        details.append(
+            {
+                "name": scenario.name,
+                # worker matrices only know union rows, so points and graph nodes are filled in here
+                "routes": [locate_route(route, rows, points, matrix) for route, rows in zip(result["routes"], result["rows"])],
+                "unassigned": serialize_unassigned(scenario.problem.requests, result["unplaced"]),
+                "timings": result["timings"],
+            }
+        )
+    finished = [row for row in summary if row["status"] == "done"]
+    best = None
+    if finished:
+        # a plan that leaves orders behind is never the reference, however short it is
+        best = min(finished, key=lambda row: (row["unassigned"], row["distance_km"]))
+        for row in finished:
+            row["distance_delta_km"] = row["distance_km"] - best["distance_km"]
+    return {
+        "best": best["name"] if best else None,
+        "summary": summary,
+        "scenarios": details,
+        "iterations": iterations,
+        "timings": timings,
+    }
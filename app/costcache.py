@@ -0,0 +1,164 @@
+import itertools
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from .graph import CACHE_DIR, graph_version
+from .metrics import increment
+
+COST_CACHE_PATH = os.environ.get("COST_CACHE_PATH", os.path.join(CACHE_DIR, "costs.db"))
+COST_CACHE_MAX_ROWS = int(os.environ.get("COST_CACHE_MAX_ROWS", "5000000"))
+COST_CACHE_MAX_AGE_DAYS = float(os.environ.get("COST_CACHE_MAX_AGE_DAYS", "30"))
+TOUCH_INTERVAL = 86400
+STORE_BATCH = 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS arc_costs (
+    graph TEXT NOT NULL,
+    source INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    distance REAL NOT NULL,
+    travel_time REAL NOT NULL,
+    path BLOB,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (graph, source, target)
+);
+CREATE INDEX IF NOT EXISTS arc_costs_used_at ON arc_costs (used_at);
+"""
+
+
+def encode_path(path: List[int]) -> bytes:
+    return zlib.compress(np.diff(np.asarray(path, dtype=np.int64), prepend=0).astype(np.int32).tobytes())
+
+
+def decode_path(blob: bytes) -> List[int]:
+    return np.cumsum(np.frombuffer(zlib.decompress(blob), dtype=np.int32), dtype=np.int64).tolist()
+
+
+class CostCache:
+    def __init__(
+        self,
+        version: str,
+        db_path: str = COST_CACHE_PATH,
+        max_rows: int = COST_CACHE_MAX_ROWS,
+        max_age_days: float = COST_CACHE_MAX_AGE_DAYS,
+    ):
+        self.version = version
+        self.db_path = os.path.abspath(db_path)
+        self.max_rows = max_rows
+        self.max_age = max_age_days * 86400
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cost-cache")
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.execute("DELETE FROM arc_costs WHERE graph != ?", (version,))
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def lookup(self, sources: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        times = np.full((len(sources), len(targets)), np.inf)
+        lengths = np.full((len(sources), len(targets)), np.inf)
+        found = np.zeros((len(sources), len(targets)), dtype=bool)
+        now = time.time()
+        self.flush()
+        with closing(self.connect()) as conn, conn:
+            # only the requested pairs are read and touched, whatever else is cached for these sources
+            conn.execute("CREATE TEMP TABLE want_sources (pos INTEGER PRIMARY KEY, node INTEGER NOT NULL)")
+            conn.execute("CREATE TEMP TABLE want_targets (pos INTEGER PRIMARY KEY, node INTEGER NOT NULL)")
+            conn.executemany("INSERT INTO want_sources VALUES (?, ?)", enumerate(np.asarray(sources, dtype=np.int64).tolist()))
+            conn.executemany("INSERT INTO want_targets VALUES (?, ?)", enumerate(np.asarray(targets, dtype=np.int64).tolist()))
+            # CROSS JOIN pins the order so every requested pair is one primary key probe
+            cached = conn.execute(
+                "SELECT s.pos, t.pos, a.distance, a.travel_time, a.used_at, a.rowid FROM want_sources s "
+                "CROSS JOIN want_targets t CROSS JOIN arc_costs a ON a.graph = ? AND a.source = s.node AND a.target = t.node",
+                (self.version,),
+            ).fetchall()
+            # used_at only drives eviction, which works in days, so rows touched within a day are not rewritten
+            stale = [(now, row[5]) for row in cached if row[4] < now - TOUCH_INTERVAL]
+            conn.executemany("UPDATE arc_costs SET used_at = ? WHERE rowid = ?", stale)
+        if cached:
+            cached = np.array(cached, dtype=np.float64)
+            rows = cached[:, 0].astype(np.int64)
+            columns = cached[:, 1].astype(np.int64)
+            lengths[rows, columns] = cached[:, 2]
+            times[rows, columns] = cached[:, 3]
+            found[rows, columns] = True
+        hits = int(found.sum())
+        increment("cost_cache_lookups", hits, result="hit")
+        increment("cost_cache_lookups", found.size - hits, result="miss")
+        return times, lengths, found
+
+    def store(self, sources: np.ndarray, targets: np.ndarray, times: np.ndarray, lengths: np.ndarray):
+        # the write runs behind the solve; callers hand over arrays they no longer change
+        self.writer.submit(self.write, np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64), times, lengths)
+
+    def write(self, sources: np.ndarray, targets: np.ndarray, times: np.ndarray, lengths: np.ndarray):
+        now = time.time()
+        source_column = np.repeat(sources, len(targets)).tolist()
+        target_column = np.tile(targets, len(sources)).tolist()
+        distance = np.asarray(lengths, dtype=np.float64).ravel().tolist()
+        travel_time = np.asarray(times, dtype=np.float64).ravel().tolist()
+        with closing(self.connect()) as conn, conn:
+            for start in range(0, len(distance), STORE_BATCH):
+                stop = start + STORE_BATCH
+                conn.executemany(
+                    "INSERT INTO arc_costs (graph, source, target, distance, travel_time, used_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (graph, source, target) DO UPDATE SET distance = excluded.distance, "
+                    "travel_time = excluded.travel_time, used_at = excluded.used_at",
+                    zip(
+                        itertools.repeat(self.version),
+                        source_column[start:stop],
+                        target_column[start:stop],
+                        distance[start:stop],
+                        travel_time[start:stop],
+                        itertools.repeat(now),
+                    ),
+                )
+        self.evict()
+
+    def flush(self):
+        self.writer.submit(lambda: None).result()
+
+    def path(self, source: int, target: int) -> Optional[List[int]]:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT path FROM arc_costs WHERE graph = ? AND source = ? AND target = ?",
+                (self.version, int(source), int(target)),
+            ).fetchone()
+        if row is None or row[0] is None:
+            increment("cost_cache_path_lookups", result="miss")
+            return None
+        increment("cost_cache_path_lookups", result="hit")
+        return decode_path(row[0])
+
+    def put_path(self, source: int, target: int, path: List[int]):
+        self.writer.submit(self.write_path, source, target, path)
+
+    def write_path(self, source: int, target: int, path: List[int]):
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "UPDATE arc_costs SET path = ? WHERE graph = ? AND source = ? AND target = ?",
+                (encode_path(path), self.version, int(source), int(target)),
+            )
+
+    def evict(self):
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM arc_costs WHERE used_at < ?", (time.time() - self.max_age,))
+            excess = conn.execute("SELECT COUNT(*) FROM arc_costs").fetchone()[0] - self.max_rows
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM arc_costs WHERE rowid IN (SELECT rowid FROM arc_costs ORDER BY used_at LIMIT ?)",
+                    (excess,),
+                )
+
+
+@lru_cache(maxsize=1)
+def get_cost_cache() -> CostCache:
+    return CostCache(graph_version())
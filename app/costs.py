@@ -0,0 +1,109 @@
+import os
+from functools import lru_cache
+from typing import Dict, Optional, Protocol, Sequence, Tuple
+import numpy as np
+from .costcache import get_cost_cache
+from .graph import get_compact_graph, resolve_nodes
+from .matrix import TravelMatrix, extend_matrix, matrix_from_nodes
+
+EARTH_RADIUS = 6371000.0
+HAVERSINE_SPEED_KMH = float(os.environ.get("HAVERSINE_SPEED_KMH", "25"))
+# straight lines understate city driving; 1.3 is a typical road circuity factor
+HAVERSINE_DETOUR = float(os.environ.get("HAVERSINE_DETOUR", "1.3"))
+MATRIX_DIR = os.environ.get("COST_MATRIX_DIR", os.path.join(os.path.dirname(__file__), "..", "cache", "matrices"))
+
+Point = Tuple[float, float]
+
+
+class CostProvider(Protocol):
+    name: str
+
+    def matrix(
+        self,
+        points: Sequence[Point],
+        node_ids: Optional[Sequence[Optional[int]]] = None,
+        workers: Optional[int] = None,
+        previous: Optional[TravelMatrix] = None,
+    ) -> TravelMatrix:
+        ...
+
+
+class GraphCostProvider:
+    name = "graph"
+
+    def __init__(self, use_cache: bool = True):
+        self.use_cache = use_cache
+
+    def matrix(self, points, node_ids=None, workers=None, previous=None) -> TravelMatrix:
+        graph = get_compact_graph()
+        nodes = resolve_nodes(points, node_ids)
+        cache = get_cost_cache() if self.use_cache else None
+        if previous is not None and previous.graph is graph:
+            return extend_matrix(previous, nodes, cache)
+        return matrix_from_nodes(graph, nodes, workers, cache)
+
+
+class HaversineCostProvider:
+    name = "haversine"
+
+    def __init__(self, speed_kmh: float = HAVERSINE_SPEED_KMH, detour: float = HAVERSINE_DETOUR):
+        self.speed_kmh = speed_kmh
+        self.detour = detour
+
+    def matrix(self, points, node_ids=None, workers=None, previous=None) -> TravelMatrix:
+        coords = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        lat, lon = coords[:, 0], coords[:, 1]
+        half_dlat = np.sin((lat[:, None] - lat[None, :]) / 2)
+        half_dlon = np.sin((lon[:, None] - lon[None, :]) / 2)
+        a = half_dlat ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * half_dlon ** 2
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0))) * self.detour
+        return TravelMatrix(
+            nodes=np.arange(len(coords), dtype=np.int32),
+            distance=distance,
+            travel_time=distance / (self.speed_kmh / 3.6),
+        )
+
+
+@lru_cache(maxsize=4)
+def load_matrix_file(path: str, mtime: float) -> Tuple[Dict[Point, int], np.ndarray, np.ndarray]:
+    with np.load(path, allow_pickle=False) as data:
+        points = np.round(data["points"].astype(np.float64), 6)
+        index = {(float(lat), float(lon)): row for row, (lat, lon) in enumerate(points)}
+        return index, data["distance"].astype(np.float64), data["travel_time"].astype(np.float64)
+
+
+class MatrixFileCostProvider:
+    name = "matrix"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def matrix(self, points, node_ids=None, workers=None, previous=None) -> TravelMatrix:
+        index, distance, travel_time = load_matrix_file(self.path, os.path.getmtime(self.path))
+        rows = []
+        for lat, lon in points:
+            row = index.get((round(float(lat), 6), round(float(lon), 6)))
+            if row is None:
+                raise ValueError(f"point {lat}, {lon} is not in {os.path.basename(self.path)}")
+            rows.append(row)
+        rows = np.array(rows, dtype=np.int64)
+        return TravelMatrix(
+            nodes=np.arange(len(rows), dtype=np.int32),
+            distance=distance[np.ix_(rows, rows)],
+            travel_time=travel_time[np.ix_(rows, rows)],
+        )
+
+
+COST_PROVIDERS = ("graph", "haversine", "matrix")
+
+
+def matrix_file_path(name: str) -> str:
+    return os.path.join(MATRIX_DIR, os.path.basename(name))
+
+
+def make_cost_provider(name: str = "graph", speed_kmh: Optional[float] = None, matrix_file: Optional[str] = None) -> CostProvider:
+    if name == "haversine":
+        return HaversineCostProvider(speed_kmh or HAVERSINE_SPEED_KMH)
+    if name == "matrix":
+        return MatrixFileCostProvider(matrix_file_path(matrix_file))
+    return GraphCostProvider()
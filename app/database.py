@@ -1,12 +1,35 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 
 DB_PATH = os.environ.get("APP_DB_PATH", os.path.join(os.path.dirname(__file__), "..", "data", "app.db"))
-os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
 engine = create_engine(f"sqlite:///{os.path.abspath(DB_PATH)}", connect_args={"check_same_thread": False})
 SessionLocal = scoped_session(sessionmaker(bind=engine))
 Base = declarative_base()
 
 def get_session():
     return SessionLocal()
+
+
+@contextmanager
+def session_scope():
+    session = get_session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def migrate_schema():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
@@ -0,0 +1,293 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from .matrix import POOL_CONTEXT, SharedArrays, TravelMatrix
+from .metrics import observe
+from .optimizer import CVRPTWOptimizer, Solution
+from .parallel import attach_matrix, shared_matrix
+
+DECOMPOSE_METHODS = ("polar", "kmeans")
+CLUSTER_SIZE = int(os.environ.get("DECOMPOSE_CLUSTER_SIZE", "250"))
+KMEANS_ROUNDS = 20
+# a k-means cluster may take this much more than its share of demand before points spill to the next centre
+BALANCE_SLACK = 1.1
+# share of the time limit left for exchanging customers between neighbouring clusters
+BOUNDARY_SHARE = 0.2
+BOUNDARY_FRACTION = (0.05, 0.15)
+
+_worker_matrix: Optional[TravelMatrix] = None
+_worker_depot: Tuple[float, float] = (0.0, 0.0)
+_worker_depot_index = 0
+
+
+def projected(points: np.ndarray) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack((points[:, 1] * np.cos(np.radians(points[:, 0].mean())), points[:, 0]))
+
+
+def split_fleet(capacities: np.ndarray, groups: int) -> List[np.ndarray]:
+    loads = np.zeros(groups)
+    labels = np.empty(len(capacities), dtype=np.int64)
+    for vehicle in np.argsort(-capacities, kind="stable"):
+        group = int(np.argmin(loads))
+        labels[vehicle] = group
+        loads[group] += capacities[vehicle]
+    return [np.flatnonzero(labels == group) for group in range(groups)]
+
+
+def polar_clusters(xy: np.ndarray, depot: np.ndarray, volumes: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    angles = np.arctan2(xy[:, 1] - depot[1], xy[:, 0] - depot[0])
+    order = np.argsort(angles, kind="stable")
+    # start the sweep at the widest empty sector so no cluster straddles it
+    sorted_angles = angles[order]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+    order = np.roll(order, -((int(np.argmax(gaps)) + 1) % len(order)))
+    middle = np.cumsum(volumes[order]) - volumes[order] / 2
+    labels = np.empty(len(xy), dtype=np.int64)
+    labels[order] = np.minimum(np.searchsorted(np.cumsum(targets), middle), len(targets) - 1)
+    return labels
+
+
+def kmeans_clusters(
+    xy: np.ndarray,
+    volumes: np.ndarray,
+    targets: np.ndarray,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    k = len(targets)
+    # k-means++ seeding
+    centers = [xy[int(rng.integers(len(xy)))]]
+    closest = ((xy - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        pick = int(rng.choice(len(xy), p=closest / closest.sum())) if closest.sum() > 0 else int(rng.integers(len(xy)))
+        centers.append(xy[pick])
+        closest = np.minimum(closest, ((xy - xy[pick]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    for _ in range(KMEANS_ROUNDS):
+        labels = ((xy[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        weight = np.bincount(labels, weights=volumes + 1e-9, minlength=k)
+        moved = np.column_stack(
+            [np.bincount(labels, weights=(volumes + 1e-9) * xy[:, axis], minlength=k) for axis in range(2)]
+        )
+        empty = weight == 0
+        moved[~empty] /= weight[~empty, None]
+        moved[empty] = centers[empty]
+        if np.allclose(moved, centers):
+            break
+        centers = moved
+    # capacitated pass: customers with the most to lose pick their centre first
+    distance = np.sqrt(((xy[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+    ranked = np.sort(distance, axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if k > 1 else np.zeros(len(xy))
+    room = targets * BALANCE_SLACK
+    labels = np.empty(len(xy), dtype=np.int64)
+    for point in np.argsort(-regret, kind="stable"):
+        choices = np.argsort(distance[point], kind="stable")
+        fits = choices[room[choices] >= volumes[point]]
+        cluster = int(fits[0]) if fits.size else int(choices[0])
+        labels[point] = cluster
+        room[cluster] -= volumes[point]
+    return labels
+
+
+def neighbour_pairs(method: str, centers: np.ndarray) -> List[Tuple[int, int]]:
+    k = len(centers)
+    if k < 2:
+        return []
+    if method == "polar":
+        return [(g, (g + 1) % k) for g in range(k if k > 2 else 1)]
+    distance = np.sqrt(((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(distance, np.inf)
+    nearest = np.argsort(distance, axis=1)[:, :2]
+    return sorted({tuple(sorted((g, int(other)))) for g in range(k) for other in nearest[g]})
+
+
+def disjoint_rounds(pairs: List[Tuple[int, int]]) -> List[List[Tuple[int, int]]]:
+    rounds: List[List[Tuple[int, int]]] = []
+    pending = list(pairs)
+    while pending:
+        busy = set()
+        current = []
+        for pair in list(pending):
+            if busy.isdisjoint(pair):
+                current.append(pair)
+                busy.update(pair)
+                pending.remove(pair)
+        rounds.append(current)
+    return rounds
+
+
+def solve_subproblem(matrix: TravelMatrix, depot, depot_index: int, task: Dict):
+    opt = CVRPTWOptimizer(
+        depot=depot,
+        requests=task["requests"],
+        vehicles=task["vehicles"],
+        matrix=matrix,
+        matrix_index=task["matrix_index"],
+        depot_index=depot_index,
+        seed=task["seed"],
+        neighbours=task["neighbours"],
+    )
+    if task["fractions"] is not None:
+        opt.min_fraction, opt.max_fraction = task["fractions"]
+    if task["routes"] is None:
+        start = opt.initial_solution()
+    else:
+        start = Solution.from_routes(task["routes"])
+        leftover = opt.unassigned(start)
+        if leftover.size:
+            start = opt.regret_repair(start, leftover)
+    best, cost = opt.search(start, task["iterations"], task["time_limit"])
+    return {"routes": best.routes(), "cost": cost, "iterations": opt.iterations_done, "stats": opt.operator_stats}
+
+
+def _init_worker(spec, clock_start, depot, depot_index):
+    global _worker_matrix, _worker_depot, _worker_depot_index
+    _worker_matrix = attach_matrix(spec, clock_start)
+    _worker_depot = depot
+    _worker_depot_index = depot_index
+
+
+def _subproblem_worker(task: Dict):
+    return solve_subproblem(_worker_matrix, _worker_depot, _worker_depot_index, task)
+
+
+class Decomposition:
+    def __init__(self, optimizer: CVRPTWOptimizer, method: str, cluster_size: int, start: Optional[Solution]):
+        self.optimizer = optimizer
+        self.method = method
+        opt = optimizer
+        groups = max(1, min(math.ceil(len(opt.requests) / max(cluster_size, 1)), len(opt.vehicles)))
+        self.fleet = split_fleet(opt.capacities, groups)
+        shares = np.array([opt.capacities[vehicles].sum() for vehicles in self.fleet])
+        targets = opt.volumes.sum() * shares / shares.sum()
+        xy = projected([r.location for r in opt.requests])
+        depot = projected([opt.depot])[0] if len(xy) else np.zeros(2)
+        if method == "polar":
+            self.labels = polar_clusters(xy, depot, opt.volumes, targets)
+        else:
+            self.labels = kmeans_clusters(xy, opt.volumes, targets, opt.rng)
+        self.centers = np.array(
+            [xy[self.labels == g].mean(axis=0) if (self.labels == g).any() else depot for g in range(groups)]
+        )
+        self.routes: List[List[int]] = [[] for _ in opt.vehicles]
+        self.seeded = start is not None
+        if start is not None:
+            group_of = np.empty(len(opt.vehicles), dtype=np.int64)
+            for g, vehicles in enumerate(self.fleet):
+                group_of[vehicles] = g
+            self.routes = start.routes()
+            for vehicle, route in enumerate(self.routes):
+                self.labels[route] = group_of[vehicle]
+
+    def task(self, groups: Tuple[int, ...], iterations, time_limit, seed, fractions) -> Tuple[Dict, np.ndarray, np.ndarray]:
+        opt = self.optimizer
+        positions = np.flatnonzero(np.isin(self.labels, groups))
+        vehicles = np.concatenate([self.fleet[g] for g in groups])
+        local = {int(pos): i for i, pos in enumerate(positions)}
+        seeded = self.seeded or len(groups) > 1
+        task = {
+            "requests": [opt.requests[pos] for pos in positions],
+            "vehicles": [opt.vehicles[v] for v in vehicles],
+            "matrix_index": opt.matrix_index[positions],
+            "routes": [[local[pos] for pos in self.routes[v]] for v in vehicles] if seeded else None,
+            "iterations": iterations,
+            "time_limit": time_limit,
+            "seed": seed,
+            "fractions": fractions,
+            "neighbours": opt.neighbour_count,
+        }
+        return task, positions, vehicles
+
+    def apply(self, groups: Tuple[int, ...], vehicles: np.ndarray, positions: np.ndarray, result: Dict, record: bool):
+        opt = self.optimizer
+        for g in groups:
+            for vehicle in self.fleet[g]:
+                self.routes[vehicle] = []
+        for slot, route in enumerate(result["routes"]):
+            vehicle = int(vehicles[slot])
+            self.routes[vehicle] = positions[route].tolist()
+        for g in groups:
+            for vehicle in self.fleet[g]:
+                self.labels[self.routes[vehicle]] = g
+        for name, op in result["stats"].items():
+            opt.operator_stats[name].merge(op)
+            if record and op.calls:
+                # worker processes keep their own registry, so their operator timings are replayed here
+                kind = "destroy" if name in opt.destroy_operators else "repair"
+                observe("operator", op.seconds, count=op.calls, operator=name, kind=kind)
+
+    def solution(self) -> Solution:
+        return Solution.from_routes(self.routes)
+
+
+def decomposed_search(
+    optimizer: CVRPTWOptimizer,
+    method: str = "polar",
+    workers: int = 1,
+    iterations: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    progress: Optional[Callable[[int, float], bool]] = None,
+    cluster_size: int = CLUSTER_SIZE,
+    start: Optional[Solution] = None,
+) -> Tuple[Solution, float]:
+    started = time.monotonic()
+    plan = Decomposition(optimizer, method, cluster_size, start)
+    groups = len(plan.fleet)
+    rounds = disjoint_rounds(neighbour_pairs(method, plan.centers))
+    base_seed = int(optimizer.rng.integers(2**31))
+    lanes = max(1, min(workers, groups))
+    cluster_time = None
+    boundary_time = None
+    if time_limit is not None:
+        cluster_time = time_limit * (1 - BOUNDARY_SHARE if rounds else 1.0) * lanes / groups
+        boundary_time = time_limit * BOUNDARY_SHARE / max(len(rounds), 1)
+    boundary_iterations = max(iterations // 4, 10) if iterations is not None else None
+    stages = [([(g,) for g in range(groups)], iterations, cluster_time, None)]
+    stages += [(pairs, boundary_iterations, boundary_time, BOUNDARY_FRACTION) for pairs in rounds]
+    done = 0
+    pool = None
+    spec_context = None
+    if workers > 1 and groups > 1:
+        arrays, clock_start = shared_matrix(optimizer.matrix)
+        spec_context = SharedArrays(arrays)
+        spec = spec_context.__enter__()
+        pool = ProcessPoolExecutor(
+            max_workers=lanes,
+            mp_context=POOL_CONTEXT,
+            initializer=_init_worker,
+            initargs=(spec, clock_start, optimizer.depot, optimizer.depot_index),
+        )
+    try:
+        for stage, (units, budget, seconds, fractions) in enumerate(stages):
+            if time_limit is not None and time.monotonic() - started >= time_limit:
+                break
+            jobs = [
+                plan.task(unit, budget, seconds, [base_seed, stage, index], fractions)
+                for index, unit in enumerate(units)
+            ]
+            tasks = [job[0] for job in jobs]
+            if pool is not None:
+                results = list(pool.map(_subproblem_worker, tasks))
+            else:
+                results = [solve_subproblem(optimizer.matrix, optimizer.depot, optimizer.depot_index, task) for task in tasks]
+            for unit, (_, positions, vehicles), result in zip(units, jobs, results):
+                plan.apply(unit, vehicles, positions, result, record=pool is not None)
+                done += result["iterations"]
+            cost = optimizer.solution_cost(plan.solution())
+            optimizer.trace.append((done, cost, cost))
+            if progress is not None and progress(done, cost) is False:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+            spec_context.__exit__(None, None, None)
+    best = plan.solution()
+    leftover = optimizer.unassigned(best)
+    if leftover.size:
+        best = optimizer.regret_repair(best, leftover)
+    optimizer.iterations_done = done
+    return best, optimizer.solution_cost(best)
@@ -1,37 +1,220 @@
 import json
 import os
-from typing import Optional, Tuple
-from geopy.geocoders import Nominatim
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+from .metrics import increment
 
 CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", "cache", "geocode_cache.json")
+STORE_PATH = os.environ.get("GEOCODE_STORE_PATH", os.path.join(os.path.dirname(__file__), "..", "cache", "geocode.db"))
+NEGATIVE_TTL_DAYS = float(os.environ.get("GEOCODE_NEGATIVE_TTL_DAYS", "7"))
+GEOCODE_RATE_LIMIT = float(os.environ.get("GEOCODE_RATE_LIMIT", "1.0"))
+GEOCODE_WORKERS = int(os.environ.get("GEOCODE_WORKERS", "2"))
+GEOCODE_RETRIES = int(os.environ.get("GEOCODE_RETRIES", "3"))
 
+Coordinates = Tuple[float, float]
 
-def ensure_cache():
-    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
-    if not os.path.exists(CACHE_PATH):
-        with open(CACHE_PATH, "w", encoding="utf-8") as fp:
-            json.dump({}, fp)
 
+class Geocoder(Protocol):
+    def geocode(self, address: str) -> Optional[Coordinates]:
+        ...
 
-def load_cache():
-    ensure_cache()
-    with open(CACHE_PATH, "r", encoding="utf-8") as fp:
-        return json.load(fp)
 
+class NominatimGeocoder:
+    def __init__(self, user_agent: str = "cvrptw-alns-app", timeout: float = 10):
+        from geopy.geocoders import Nominatim
 
-def save_cache(cache):
-    with open(CACHE_PATH, "w", encoding="utf-8") as fp:
-        json.dump(cache, fp, ensure_ascii=False, indent=2)
+        self.locator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, address: str) -> Optional[Coordinates]:
+        location = self.locator.geocode(address)
+        if location:
+            return location.latitude, location.longitude
+        return None
+
+
+class RateLimiter:
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_geocoder: Optional[Geocoder] = None
+
+
+def get_geocoder() -> Geocoder:
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = NominatimGeocoder()
+    return _geocoder
+
+
+def set_geocoder(geocoder: Optional[Geocoder]):
+    global _geocoder
+    _geocoder = geocoder
+
+
+# the limit belongs to the service, so every import and single lookup waits on the same slots
+_limiters: "weakref.WeakKeyDictionary[Geocoder, RateLimiter]" = weakref.WeakKeyDictionary()
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(geocoder: Geocoder, rate_limit: float = GEOCODE_RATE_LIMIT) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(geocoder)
+        if limiter is None:
+            limiter = _limiters[geocoder] = RateLimiter(rate_limit)
+        return limiter
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    key TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    found INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS geocode_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+BATCH = 500
+
+
+def normalize_address(address: str) -> str:
+    return " ".join(re.sub(r"[,;]+", " ", address).casefold().split())
+
+
+class GeocodeStore:
+    def __init__(self, db_path: str = STORE_PATH, negative_ttl_days: float = NEGATIVE_TTL_DAYS):
+        self.db_path = os.path.abspath(db_path)
+        self.negative_ttl = negative_ttl_days * 86400
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self.migrate_json(CACHE_PATH)
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get_many(self, addresses: Iterable[str]) -> Dict[str, Optional[Coordinates]]:
+        keys: Dict[str, List[str]] = {}
+        for address in addresses:
+            keys.setdefault(normalize_address(address), []).append(address)
+        results: Dict[str, Optional[Coordinates]] = {}
+        expired = time.time() - self.negative_ttl
+        key_list = list(keys)
+        with closing(self.connect()) as conn:
+            for start in range(0, len(key_list), BATCH):
+                chunk = key_list[start:start + BATCH]
+                rows = conn.execute(
+                    f"SELECT key, lat, lon, found, updated_at FROM geocodes WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, lat, lon, found, updated_at in rows:
+                    if not found and updated_at < expired:
+                        continue
+                    for address in keys[key]:
+                        results[address] = (lat, lon) if found else None
+        return results
+
+    def put_many(self, items: Dict[str, Optional[Coordinates]]):
+        now = time.time()
+        rows = [
+            (normalize_address(address), address, coords[0] if coords else None, coords[1] if coords else None, int(bool(coords)), now)
+            for address, coords in items.items()
+        ]
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO geocodes (key, address, lat, lon, found, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET address = excluded.address, lat = excluded.lat, "
+                "lon = excluded.lon, found = excluded.found, updated_at = excluded.updated_at",
+                rows,
+            )
+
+    def migrate_json(self, path: str):
+        if not os.path.exists(path):
+            return
+        with closing(self.connect()) as conn:
+            if conn.execute("SELECT 1 FROM geocode_meta WHERE name = 'json_migrated'").fetchone():
+                return
+        with open(path, "r", encoding="utf-8") as fp:
+            legacy = json.load(fp)
+        self.put_many({address: (item["lat"], item["lon"]) for address, item in legacy.items()})
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO geocode_meta (name, value) VALUES ('json_migrated', ?)", (str(time.time()),))
+
+
+@lru_cache(maxsize=1)
+def get_geocode_store() -> GeocodeStore:
+    return GeocodeStore(STORE_PATH)
+
+
+def lookup_with_retries(geocoder: Geocoder, limiter: RateLimiter, address: str, retries: int) -> Tuple[Optional[Coordinates], bool]:
+    from geopy.exc import GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            coords = geocoder.geocode(address)
+        except (GeocoderTimedOut, GeocoderUnavailable, GeocoderServiceError):
+            increment("geocode_requests", result="error")
+            if attempt < retries:
+                time.sleep(min(2 ** attempt, 30))
+            continue
+        increment("geocode_requests", result="found" if coords else "empty")
+        return coords, True
+    return None, False
+
+
+def geocode_many(
+    addresses: Iterable[str],
+    geocoder: Optional[Geocoder] = None,
+    rate_limit: float = GEOCODE_RATE_LIMIT,
+    workers: int = GEOCODE_WORKERS,
+    retries: int = GEOCODE_RETRIES,
+) -> Dict[str, Optional[Coordinates]]:
+    unique = list(dict.fromkeys(address for address in addresses if address))
+    store = get_geocode_store()
+    results = store.get_many(unique)
+    misses = list({normalize_address(address): address for address in unique if address not in results}.values())
+    increment("geocode_lookups", len(results), result="hit")
+    increment("geocode_lookups", len(unique) - len(results), result="miss")
+    if not misses:
+        return results
+    geocoder = geocoder or get_geocoder()
+    limiter = get_limiter(geocoder, rate_limit)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        found = list(pool.map(lambda address: lookup_with_retries(geocoder, limiter, address, retries), misses))
+    # only answers from the geocoder are cached; exhausted retries are retried on the next import
+    store.put_many({address: coords for address, (coords, answered) in zip(misses, found) if answered})
+    by_key = {normalize_address(address): coords for address, (coords, _) in zip(misses, found)}
+    for address in unique:
+        if address not in results:
+            results[address] = by_key[normalize_address(address)]
+    return results
 
 
 def geocode_address(address: str) -> Optional[Tuple[float, float]]:
-    cache = load_cache()
-    if address in cache:
-        return cache[address]["lat"], cache[address]["lon"]
-    locator = Nominatim(user_agent="cvrptw-alns-app")
-    location = locator.geocode(address)
-    if location:
-        cache[address] = {"lat": location.latitude, "lon": location.longitude}
-        save_cache(cache)
-        return location.latitude, location.longitude
-    return None
+    return geocode_many([address], workers=1).get(address)
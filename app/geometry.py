@@ -0,0 +1,105 @@
+from typing import Dict, List, Optional
+import numpy as np
+from .costcache import get_cost_cache
+from .graph import get_compact_graph
+from .matrix import TravelMatrix
+from .plans import recall_matrix
+
+POLYLINE_PRECISION = 5
+TILE_SIZE = 256
+MAX_ZOOM = 20
+
+
+def zoom_tolerance(zoom: int) -> float:
+    # one screen pixel at this zoom level, in degrees of longitude
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    # measure in locally isotropic units so the tolerance means the same north-south and east-west
+    scaled = points * np.array([1.0, np.cos(np.radians(points[:, 0].mean()))])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = scaled[first], scaled[last]
+        inner = scaled[first + 1:last]
+        chord = end - start
+        length = np.hypot(*chord)
+        if length == 0:
+            offsets = np.hypot(*(inner - start).T)
+        else:
+            offsets = np.abs(chord[0] * (inner[:, 1] - start[1]) - chord[1] * (inner[:, 0] - start[0])) / length
+        farthest = int(np.argmax(offsets))
+        if offsets[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def encode_polyline(points: np.ndarray, precision: int = POLYLINE_PRECISION) -> str:
+    if not len(points):
+        return ""
+    scaled = np.round(np.asarray(points, dtype=np.float64) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def road_path(node_ids: List[int], plan: Optional[str]) -> np.ndarray:
+    graph = get_compact_graph()
+    nodes = graph.index_of(node_ids)
+    matrix = recall_matrix(plan) if plan else None
+    if matrix is None or matrix.graph is not graph or not np.isin(nodes, matrix.nodes).all():
+        # the solve's matrix is gone, so search from the route's own nodes and lean on the cost cache
+        unique = np.unique(nodes)
+        matrix = TravelMatrix(
+            nodes=unique,
+            distance=np.empty((0, 0)),
+            travel_time=np.empty((0, 0)),
+            trees=[None] * len(unique),
+            graph=graph,
+            cache=get_cost_cache(),
+        )
+    order = np.argsort(matrix.nodes, kind="stable")
+    rows = order[np.searchsorted(matrix.nodes[order], nodes)]
+    path: List[int] = [int(nodes[0])] if len(nodes) else []
+    for origin, destination in zip(rows[:-1], rows[1:]):
+        leg = matrix.path(int(origin), int(destination))
+        path.extend(leg[1:] if leg else [int(matrix.nodes[destination])])
+    return np.column_stack((graph.lat[path], graph.lon[path]))
+
+
+def route_geometry(result: Dict, index: int, zoom: Optional[int] = None) -> Optional[Dict]:
+    routes = result.get("routes", [])
+    if not 0 <= index < len(routes):
+        return None
+    route = routes[index]
+    if route.get("nodes"):
+        points = road_path(route["nodes"], result.get("plan"))
+    else:
+        points = np.asarray(route.get("points", []), dtype=np.float64).reshape(-1, 2)
+    full = len(points)
+    if zoom is not None:
+        points = simplify(points, zoom_tolerance(min(max(zoom, 0), MAX_ZOOM)))
+    return {
+        "vehicle": route["vehicle"],
+        "polyline": encode_polyline(points),
+        "precision": POLYLINE_PRECISION,
+        "points": len(points),
+        "source_points": full,
+        "zoom": zoom,
+    }
@@ -1,11 +1,52 @@
+import fcntl
 import os
 import json
+import hashlib
+import shutil
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 from functools import lru_cache
-import osmnx as ox
-import networkx as nx
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import numpy as np
+from .metrics import timer
+
+if TYPE_CHECKING:
+    import networkx as nx
 
 CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "cache")
 GRAPH_PATH = os.path.join(CACHE_DIR, "kyiv.graphml")
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "kyiv_snapshot")
+SNAPSHOT_FORMAT = 2
+# OSM highway tags grouped by how differently they congest; links share their road's class
+ROAD_CLASSES = ("motorway", "trunk", "primary", "secondary", "tertiary", "local")
+
+
+@dataclass
+class CompactGraph:
+    node_ids: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    travel_time: np.ndarray
+    length: np.ndarray
+    road_class: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return len(self.node_ids)
+
+    def index_of(self, node_ids) -> np.ndarray:
+        return np.searchsorted(self.node_ids, np.asarray(node_ids, dtype=np.int64)).astype(np.int32)
+
+    def edge_keys(self) -> np.ndarray:
+        rows = np.repeat(np.arange(self.size, dtype=np.int64), np.diff(self.indptr))
+        return rows * self.size + self.indices
+
+    def travel_time_csr(self):
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((self.travel_time, self.indices, self.indptr), shape=(self.size, self.size))
 
 
 def ensure_cache_dir():
@@ -13,6 +54,8 @@ def ensure_cache_dir():
 
 
 def load_kyiv_graph():
+    import osmnx as ox
+
     ensure_cache_dir()
     if os.path.exists(GRAPH_PATH):
         return ox.load_graphml(GRAPH_PATH)
@@ -28,19 +71,178 @@ def get_graph():
     return load_kyiv_graph()
 
 
-def nearest_node(graph: nx.MultiDiGraph, point):
-    return ox.distance.nearest_nodes(graph, point[1], point[0])
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_stamp() -> Optional[Dict[str, int]]:
+    if not os.path.exists(GRAPH_PATH):
+        return None
+    stat = os.stat(GRAPH_PATH)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_snapshot_meta() -> Optional[Dict]:
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, "meta.json"), "r", encoding="utf-8") as fp:
+            meta = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        return None
+    stamp = source_stamp()
+    if stamp is not None and meta.get("source") != stamp:
+        return None
+    return meta
+
+
+@lru_cache(maxsize=1)
+def graph_version() -> str:
+    meta = read_snapshot_meta()
+    if meta is not None:
+        return meta["version"]
+    return file_digest(GRAPH_PATH)
+
+
+def road_class(highway) -> int:
+    if isinstance(highway, list):
+        highway = highway[0] if highway else None
+    name = str(highway or "").removesuffix("_link")
+    return ROAD_CLASSES.index(name) if name in ROAD_CLASSES[:-1] else len(ROAD_CLASSES) - 1
+
+
+def compact_graph(graph: "nx.MultiDiGraph") -> CompactGraph:
+    node_ids = np.sort(np.fromiter(graph.nodes, dtype=np.int64, count=graph.number_of_nodes()))
+    lat = np.array([graph.nodes[node]["y"] for node in node_ids], dtype=np.float64)
+    lon = np.array([graph.nodes[node]["x"] for node in node_ids], dtype=np.float64)
+    edges = [
+        (u, v, float(data["travel_time"]), float(data["length"]), road_class(data.get("highway")))
+        for u, v, data in graph.edges(data=True)
+        if u != v
+    ]
+    rows = np.searchsorted(node_ids, np.array([e[0] for e in edges], dtype=np.int64))
+    cols = np.searchsorted(node_ids, np.array([e[1] for e in edges], dtype=np.int64))
+    # csgraph drops explicit zeros, so zero-time edges keep a tiny positive weight
+    travel_time = np.maximum(np.array([e[2] for e in edges], dtype=np.float64), 1e-6)
+    length = np.array([e[3] for e in edges], dtype=np.float64)
+    classes = np.array([e[4] for e in edges], dtype=np.uint8)
+    # keep the fastest of parallel edges, the same edge shortest_path would traverse
+    order = np.lexsort((travel_time, cols, rows))
+    rows, cols, travel_time, length, classes = rows[order], cols[order], travel_time[order], length[order], classes[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, travel_time, length, classes = rows[first], cols[first], travel_time[first], length[first], classes[first]
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(node_ids)), out=indptr[1:])
+    return CompactGraph(
+        node_ids=node_ids,
+        lat=lat,
+        lon=lon,
+        indptr=indptr.astype(np.int32),
+        indices=cols.astype(np.int32),
+        travel_time=travel_time,
+        length=length,
+        road_class=classes,
+    )
+
+
+def save_snapshot(graph: CompactGraph, version: str):
+    ensure_cache_dir()
+    staging = f"{SNAPSHOT_DIR}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for item in fields(CompactGraph):
+        np.save(os.path.join(staging, f"{item.name}.npy"), getattr(graph, item.name))
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as fp:
+        json.dump({"format": SNAPSHOT_FORMAT, "version": version, "source": source_stamp()}, fp)
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+    os.replace(staging, SNAPSHOT_DIR)
+
+
+def load_snapshot() -> Optional[CompactGraph]:
+    if read_snapshot_meta() is None:
+        return None
+    try:
+        arrays = {
+            item.name: np.load(os.path.join(SNAPSHOT_DIR, f"{item.name}.npy"), mmap_mode="r")
+            for item in fields(CompactGraph)
+        }
+    except (OSError, ValueError):
+        return None
+    return CompactGraph(**arrays)
+
+
+@contextmanager
+def snapshot_lock():
+    ensure_cache_dir()
+    with open(f"{SNAPSHOT_DIR}.lock", "w") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def build_snapshot() -> CompactGraph:
+    # gunicorn workers start together: one rebuilds, the rest wait and load its snapshot
+    with snapshot_lock():
+        graph = load_snapshot()
+        if graph is not None:
+            return graph
+        graph = compact_graph(get_graph())
+        save_snapshot(graph, file_digest(GRAPH_PATH))
+        graph_version.cache_clear()
+        return load_snapshot() or graph
+
+
+@lru_cache(maxsize=1)
+def get_compact_graph() -> CompactGraph:
+    return load_snapshot() or build_snapshot()
+
+
+def unit_vectors(lat, lon) -> np.ndarray:
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+@lru_cache(maxsize=1)
+def get_node_index():
+    from scipy.spatial import cKDTree
+
+    graph = get_compact_graph()
+    # chord length on the unit sphere grows monotonically with haversine distance
+    return cKDTree(unit_vectors(graph.lat, graph.lon))
+
+
+def snap_points(points: List[Tuple[float, float]]) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return np.empty(0, dtype=np.int32)
+    with timer("snap"):
+        _, nodes = get_node_index().query(unit_vectors(points[:, 0], points[:, 1]), k=1)
+    return nodes.astype(np.int32)
+
+
+def resolve_nodes(points: List[Tuple[float, float]], node_ids: Optional[List[Optional[int]]] = None) -> np.ndarray:
+    graph = get_compact_graph()
+    nodes = np.full(len(points), -1, dtype=np.int32)
+    if node_ids is not None:
+        known = np.array([node is not None for node in node_ids], dtype=bool)
+        ids = np.array([node if node is not None else 0 for node in node_ids], dtype=np.int64)
+        pos = np.minimum(graph.index_of(ids), graph.size - 1)
+        valid = known & (graph.node_ids[pos] == ids)
+        nodes[valid] = pos[valid]
+    missing = np.flatnonzero(nodes < 0)
+    if missing.size:
+        nodes[missing] = snap_points(np.asarray(points, dtype=np.float64).reshape(-1, 2)[missing])
+    return nodes
 
 
-def shortest_path_info(graph: nx.MultiDiGraph, origin, destination):
-    origin_node = nearest_node(graph, origin)
-    dest_node = nearest_node(graph, destination)
-    path = ox.shortest_path(graph, origin_node, dest_node, weight="travel_time")
-    length_m = sum(ox.utils_graph.get_route_edge_attributes(graph, path, "length"))
-    travel_time = sum(ox.utils_graph.get_route_edge_attributes(graph, path, "travel_time"))
-    coordinates = [(graph.nodes[node]["y"], graph.nodes[node]["x"]) for node in path]
-    return {
-        "path": coordinates,
-        "distance": length_m,
-        "travel_time": travel_time,
-    }
+if __name__ == "__main__":
+    compact = build_snapshot()
+    print(f"snapshot written to {os.path.abspath(SNAPSHOT_DIR)}: {compact.size} nodes, {len(compact.indices)} edges")
@@ -0,0 +1,122 @@
+import os
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from .geocode import geocode_many
+from .models import Order, bump_revision
+
+IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "50000"))
+INSERT_BATCH = 5000
+MAX_REPORTED_ERRORS = 1000
+REQUIRED_COLUMNS = {"id", "volume"}
+
+
+def read_frames(file, chunk_rows: int = IMPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    filename = (file.filename or "").lower()
+    if filename.endswith(".csv"):
+        yield from pd.read_csv(file.stream, chunksize=chunk_rows)
+    else:
+        yield pd.read_excel(file.stream)
+
+
+def numeric_column(df: pd.DataFrame, name: str) -> Tuple[pd.Series, pd.Series]:
+    if name not in df.columns:
+        empty = pd.Series(np.nan, index=df.index)
+        return empty, pd.Series(False, index=df.index)
+    raw = df[name]
+    values = pd.to_numeric(raw, errors="coerce")
+    return values, values.isna() & raw.notna()
+
+
+def prepare_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    errors = pd.Series("", index=df.index, dtype=object)
+
+    def flag(mask: pd.Series, message: str):
+        mask = mask & (errors == "")
+        errors[mask] = message
+
+    external_id = df["id"]
+    flag(external_id.isna(), "missing id")
+    volume, bad_volume = numeric_column(df, "volume")
+    flag(bad_volume | volume.isna(), "invalid volume")
+    window_start, bad_start = numeric_column(df, "window_start")
+    flag(bad_start, "invalid window_start")
+    window_end, bad_end = numeric_column(df, "window_end")
+    flag(bad_end, "invalid window_end")
+    lat, bad_lat = numeric_column(df, "lat")
+    lon, bad_lon = numeric_column(df, "lon")
+    flag(bad_lat | bad_lon, "invalid coordinates")
+    if "address" in df.columns:
+        address = df["address"].where(df["address"].notna(), None)
+        address = address.map(lambda value: str(value).strip() if value is not None else None)
+        address = address.where(address != "", None)
+    else:
+        address = pd.Series(None, index=df.index, dtype=object)
+    pending = (lat.isna() | lon.isna()) & address.notna() & (errors == "")
+    if pending.any():
+        coords = geocode_many(address[pending])
+        found = address[pending].map(lambda value: coords.get(value))
+        hit = found.notna()
+        lat.loc[found.index[hit]] = found[hit].map(lambda c: c[0])
+        lon.loc[found.index[hit]] = found[hit].map(lambda c: c[1])
+    flag(lat.isna() | lon.isna(), "no coordinates")
+    flag((lat.abs() > 90) | (lon.abs() > 180), "coordinates out of range")
+    frame = pd.DataFrame(
+        {
+            "external_id": external_id.astype(str),
+            "address": address,
+            "latitude": lat.astype(float),
+            "longitude": lon.astype(float),
+            "volume": volume.astype(float),
+            "window_start": window_start.astype(float),
+            "window_end": window_end.astype(float),
+        }
+    )
+    return frame[errors == ""], errors[errors != ""]
+
+
+def frame_records(frame: pd.DataFrame) -> List[Dict]:
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient="records")
+
+
+def import_frames(session, frames: Iterator[pd.DataFrame]):
+    summary = {"rows": 0, "created": 0, "skipped": 0, "complete": True, "errors": []}
+    offset = 0
+    statement = Order.__table__.insert()
+    while True:
+        try:
+            df = next(frames)
+        except StopIteration:
+            break
+        except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as exc:
+            # the reader cannot resume past a malformed chunk; the chunks committed before it stay
+            stop_import(summary, offset, f"unreadable data: {exc}")
+            break
+        df = df.reset_index(drop=True)
+        try:
+            valid, errors = prepare_frame(df)
+            records = frame_records(valid)
+            for start in range(0, len(records), INSERT_BATCH):
+                session.execute(statement, records[start:start + INSERT_BATCH])
+            if records:
+                bump_revision(session, "orders")
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            stop_import(summary, offset, f"rows {offset + 1}-{offset + len(df)} were not imported: {exc}")
+            break
+        summary["rows"] += len(df)
+        summary["created"] += len(records)
+        summary["skipped"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(summary["errors"])
+        for index, message in errors.iloc[:max(room, 0)].items():
+            summary["errors"].append({"row": offset + int(index) + 1, "error": message})
+        offset += len(df)
+    return summary
+
+
+def stop_import(summary: Dict, offset: int, message: str):
+    summary["complete"] = False
+    summary["stopped_at_row"] = offset + 1
+    summary["errors"].append({"row": offset + 1, "error": message})
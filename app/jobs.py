@@ -0,0 +1,156 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Optional
+from .database import session_scope
+from .metrics import increment, timer
+from .models import SolveJob
+from .solver import Problem, SolveOptions, solve_problem
+
+JOB_WORKERS = int(os.environ.get("SOLVE_JOB_WORKERS", "2"))
+PROGRESS_INTERVAL = 0.5
+FINISHED = ("done", "failed", "cancelled")
+
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="solve-job")
+
+
+def serialize_job(job: SolveJob):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "progress": job.progress,
+        "iteration": job.iteration,
+        "best_cost": job.best_cost,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+def submit_job(problem: Problem, options: SolveOptions, solve=solve_problem, budget: Optional[int] = None) -> str:
+    job_id = uuid.uuid4().hex
+    with session_scope() as session:
+        session.add(SolveJob(id=job_id, status="queued", params=json.dumps(asdict(options)), owner_pid=os.getpid()))
+        session.commit()
+    executor.submit(run_job, job_id, problem, options, solve, budget)
+    return job_id
+
+
+def run_job(job_id: str, problem: Problem, options: SolveOptions, solve=solve_problem, budget: Optional[int] = None):
+    with session_scope() as session:
+        job = session.get(SolveJob, job_id)
+        if job.status == "cancelled":
+            return
+        job.status = "running"
+        session.commit()
+    started = time.monotonic()
+    last_report = 0.0
+    total = budget
+    if total is None and options.iterations:
+        total = options.iterations * max(options.workers, 1)
+
+    def progress(iteration: int, best_cost: float) -> bool:
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < PROGRESS_INTERVAL:
+            return True
+        last_report = now
+        fractions = []
+        if total:
+            fractions.append(iteration / total)
+        if options.time_limit:
+            fractions.append((now - started) / options.time_limit)
+        with session_scope() as session:
+            job = session.get(SolveJob, job_id)
+            if job.status == "cancelled":
+                return False
+            job.iteration = iteration
+            job.best_cost = best_cost
+            job.progress = min(max(fractions, default=0.0), 1.0)
+            session.commit()
+        return True
+
+    try:
+        with timer("solve"):
+            result = solve(problem, options, progress)
+    except Exception as exc:
+        increment("solves", status="failed")
+        with session_scope() as session:
+            job = session.get(SolveJob, job_id)
+            job.status = "failed"
+            job.error = str(exc)
+            session.commit()
+        return
+    with session_scope() as session:
+        job = session.get(SolveJob, job_id)
+        with timer("serialize"):
+            job.result = json.dumps(result, ensure_ascii=False)
+        increment("solves", status="done")
+        job.iteration = result["iterations"]
+        if job.status != "cancelled":
+            job.status = "done"
+            job.progress = 1.0
+        session.commit()
+
+
+def get_job(job_id: str):
+    with session_scope() as session:
+        job = session.get(SolveJob, job_id)
+        return serialize_job(job) if job else None
+
+
+def get_job_result(job_id: str):
+    with session_scope() as session:
+        job = session.get(SolveJob, job_id)
+        if job is None:
+            return None
+        return job.result
+
+
+def cancel_job(job_id: str):
+    with session_scope() as session:
+        job = session.get(SolveJob, job_id)
+        if job is None:
+            return None
+        if job.status not in FINISHED:
+            job.status = "cancelled"
+            session.commit()
+        return serialize_job(job)
+
+
+def job_events(job_id: str):
+    last = None
+    while True:
+        state = get_job(job_id)
+        if state is None:
+            return
+        if state != last:
+            event = state["status"] if state["status"] in FINISHED else "progress"
+            yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+            last = state
+        if state["status"] in FINISHED:
+            return
+        time.sleep(PROGRESS_INTERVAL)
+
+
+def recover_jobs():
+    with session_scope() as session:
+        for job in session.query(SolveJob).filter(SolveJob.status.in_(("queued", "running"))):
+            if job.owner_pid and process_alive(job.owner_pid):
+                continue
+            job.status = "failed"
+            job.error = "interrupted by worker restart"
+        session.commit()
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,377 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .costcache import CostCache
+from .graph import CompactGraph
+from .metrics import increment
+
+SOURCE_CHUNK = 32
+HOUR = 3600.0
+MATRIX_WORKERS = int(os.environ.get("MATRIX_WORKERS", "1"))
+
+_worker_graph: Optional[CompactGraph] = None
+_worker_blocks: List[shared_memory.SharedMemory] = []
+_worker_slowed: Dict[bytes, CompactGraph] = {}
+
+
+@dataclass
+class PathTree:
+    nodes: np.ndarray
+    parents: np.ndarray
+
+    def path(self, target: int) -> List[int]:
+        pos = int(np.searchsorted(self.nodes, target))
+        if pos >= len(self.nodes) or self.nodes[pos] != target:
+            return []
+        path = [target]
+        while self.parents[pos] != pos:
+            pos = int(self.parents[pos])
+            path.append(int(self.nodes[pos]))
+        path.reverse()
+        return path
+
+
+@dataclass
+class TimeBuckets:
+    hour_bucket: np.ndarray
+    times: np.ndarray
+    clock_start: float = 0.0
+
+    def bucket_at(self, departure):
+        hours = np.floor((self.clock_start + np.asarray(departure)) / HOUR).astype(np.int64)
+        return self.hour_bucket[hours % len(self.hour_bucket)]
+
+    def leg_time(self, origin: int, destination: int, departure: float) -> float:
+        hour = int((self.clock_start + departure) // HOUR) % len(self.hour_bucket)
+        return float(self.times[self.hour_bucket[hour], origin, destination])
+
+
+@dataclass
+class TravelMatrix:
+    nodes: np.ndarray
+    distance: np.ndarray
+    travel_time: np.ndarray
+    trees: List[Optional[PathTree]] = field(default_factory=list)
+    graph: Optional[CompactGraph] = None
+    cache: Optional[CostCache] = None
+    buckets: Optional[TimeBuckets] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.nodes)
+
+    def leg_time(self, origin: int, destination: int, departure: float) -> float:
+        if self.buckets is None:
+            return float(self.travel_time[origin, destination])
+        return self.buckets.leg_time(origin, destination, departure)
+
+    def leg_times(self, origins: np.ndarray, destinations: np.ndarray, departures: np.ndarray) -> np.ndarray:
+        if self.buckets is None:
+            return self.travel_time[origins, destinations]
+        return self.buckets.times[self.buckets.bucket_at(departures), origins, destinations]
+
+    def path(self, origin: int, destination: int) -> List[int]:
+        source, target = int(self.nodes[origin]), int(self.nodes[destination])
+        if self.cache is not None:
+            cached = self.cache.path(self.graph.node_ids[source], self.graph.node_ids[target])
+            if cached is not None:
+                return cached
+        tree = self.trees[origin] if self.trees else None
+        path = tree.path(target) if tree is not None else []
+        # trees reused from an earlier matrix do not reach targets added since
+        if not path and self.graph is not None:
+            path = self.search(origin).path(target)
+        if self.cache is not None and path:
+            self.cache.put_path(self.graph.node_ids[source], self.graph.node_ids[target], path)
+        return path
+
+    def search(self, origin: int) -> PathTree:
+        _, _, trees = one_to_all(self.graph, [int(self.nodes[origin])], np.unique(self.nodes))
+        for pos, node in enumerate(self.nodes):
+            if node == self.nodes[origin]:
+                self.trees[pos] = trees[0]
+        return trees[0]
+
+    def geometry(self, origin: int, destination: int) -> List[Tuple[float, float]]:
+        if self.graph is None:
+            return []
+        return [(float(self.graph.lat[node]), float(self.graph.lon[node])) for node in self.path(origin, destination)]
+
+
+def path_tree(
+    graph: CompactGraph,
+    edge_keys: np.ndarray,
+    source: int,
+    predecessors: np.ndarray,
+    targets: np.ndarray,
+    reverse: bool = False,
+):
+    on_path = np.zeros(graph.size, dtype=bool)
+    frontier = np.unique(targets[(predecessors[targets] >= 0) | (targets == source)])
+    while frontier.size:
+        on_path[frontier] = True
+        parents = predecessors[frontier]
+        parents = parents[parents >= 0]
+        frontier = np.unique(parents[~on_path[parents]])
+    nodes = np.flatnonzero(on_path).astype(np.int32)
+    if not nodes.size:
+        return PathTree(nodes=nodes, parents=nodes.copy()), np.full(len(targets), np.inf)
+    own = np.arange(len(nodes), dtype=np.int32)
+    pred = predecessors[nodes]
+    is_root = pred < 0
+    parents = np.where(is_root, own, np.searchsorted(nodes, np.where(is_root, 0, pred))).astype(np.int32)
+    # a search on the transposed graph records successors, so its edges run node -> pred
+    tails, heads = (nodes, pred) if reverse else (pred, nodes)
+    keys = np.where(is_root, 0, tails.astype(np.int64) * graph.size + heads)
+    step = np.where(is_root, 0.0, graph.length[np.searchsorted(edge_keys, keys)])
+    jump = parents.copy()
+    while True:
+        step = step + np.where(jump != own, step[jump], 0.0)
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        jump = next_jump
+    lengths = np.full(len(targets), np.inf)
+    pos = np.searchsorted(nodes, targets)
+    found = (pos < len(nodes)) & (nodes[np.minimum(pos, len(nodes) - 1)] == targets)
+    lengths[found] = step[pos[found]]
+    return PathTree(nodes=nodes, parents=parents), lengths
+
+
+def one_to_all(graph: CompactGraph, sources: Sequence[int], targets: np.ndarray):
+    from scipy.sparse.csgraph import dijkstra
+
+    csr = graph.travel_time_csr()
+    edge_keys = graph.edge_keys()
+    sources = np.asarray(sources, dtype=np.int32)
+    increment("dijkstra_sources", len(sources), direction="forward")
+    times = np.empty((len(sources), len(targets)))
+    lengths = np.empty((len(sources), len(targets)))
+    trees: List[PathTree] = []
+    for start in range(0, len(sources), SOURCE_CHUNK):
+        chunk = sources[start:start + SOURCE_CHUNK]
+        dist, predecessors = dijkstra(csr, directed=True, indices=chunk, return_predecessors=True)
+        for offset, source in enumerate(chunk):
+            row = start + offset
+            times[row] = dist[offset, targets]
+            tree, lengths[row] = path_tree(graph, edge_keys, int(source), predecessors[offset], targets)
+            trees.append(tree)
+    return times, lengths, trees
+
+
+def travel_times(graph: CompactGraph, sources: np.ndarray, targets: np.ndarray, reverse: bool = False) -> np.ndarray:
+    from scipy.sparse.csgraph import dijkstra
+
+    # reverse searches run from sinks over the transposed graph: row i holds times from each target to sources[i]
+    csr = graph.travel_time_csr().T.tocsr() if reverse else graph.travel_time_csr()
+    increment("dijkstra_sources", len(sources), direction="backward" if reverse else "forward")
+    times = np.empty((len(sources), len(targets)))
+    for start in range(0, len(sources), SOURCE_CHUNK):
+        chunk = np.asarray(sources[start:start + SOURCE_CHUNK], dtype=np.int32)
+        times[start:start + len(chunk)] = dijkstra(csr, directed=True, indices=chunk)[:, targets]
+    return times
+
+
+def slowed_graph(graph: CompactGraph, factor: np.ndarray) -> CompactGraph:
+    return replace(graph, travel_time=graph.travel_time * factor[graph.road_class])
+
+
+def all_to_one(graph: CompactGraph, sinks: Sequence[int], sources: np.ndarray):
+    from scipy.sparse.csgraph import dijkstra
+
+    csr = graph.travel_time_csr().T.tocsr()
+    edge_keys = graph.edge_keys()
+    sinks = np.asarray(sinks, dtype=np.int32)
+    increment("dijkstra_sources", len(sinks), direction="reverse")
+    times = np.empty((len(sources), len(sinks)))
+    lengths = np.empty((len(sources), len(sinks)))
+    for start in range(0, len(sinks), SOURCE_CHUNK):
+        chunk = sinks[start:start + SOURCE_CHUNK]
+        dist, predecessors = dijkstra(csr, directed=True, indices=chunk, return_predecessors=True)
+        for offset, sink in enumerate(chunk):
+            column = start + offset
+            times[:, column] = dist[offset, sources]
+            _, lengths[:, column] = path_tree(graph, edge_keys, int(sink), predecessors[offset], sources, reverse=True)
+    return times, lengths
+
+
+# pools are started from job threads: a forked child could inherit a lock (metrics, logging) held by another
+# thread and block on it forever, so workers come from a clean forkserver and get everything through initargs
+POOL_CONTEXT = multiprocessing.get_context("forkserver")
+
+
+class SharedArrays:
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.spec: Dict[str, Tuple[str, Tuple[int, ...], str]] = {}
+
+    def __enter__(self):
+        for name, array in self.arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+        return self.spec
+
+    def __exit__(self, *exc):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def attach_arrays(spec: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> Dict[str, np.ndarray]:
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _worker_blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays
+
+
+def _attach_graph(spec: Dict[str, Tuple[str, Tuple[int, ...], str]]):
+    global _worker_graph
+    _worker_graph = CompactGraph(**attach_arrays(spec))
+
+
+def _one_to_all_worker(sources: np.ndarray, targets: np.ndarray):
+    return one_to_all(_worker_graph, sources, targets)
+
+
+def _slowed_times_worker(factor: np.ndarray, sources: np.ndarray, targets: np.ndarray, reverse: bool):
+    key = factor.tobytes()
+    if key not in _worker_slowed:
+        _worker_slowed.clear()
+        _worker_slowed[key] = slowed_graph(_worker_graph, factor)
+    return travel_times(_worker_slowed[key], sources, targets, reverse)
+
+
+def slowed_travel_times(
+    graph: CompactGraph,
+    jobs: List[Tuple[np.ndarray, np.ndarray, np.ndarray, bool]],
+    workers: Optional[int] = None,
+) -> List[np.ndarray]:
+    workers = MATRIX_WORKERS if workers is None else workers
+    searches = sum(len(sources) for _, sources, _, _ in jobs)
+    if workers <= 1 or searches <= SOURCE_CHUNK:
+        return [travel_times(slowed_graph(graph, factor), sources, targets, reverse) for factor, sources, targets, reverse in jobs]
+    tasks = []
+    for index, (factor, sources, targets, reverse) in enumerate(jobs):
+        for chunk in np.array_split(sources, max(1, min(len(sources), round(workers * 4 * len(sources) / searches)))):
+            if len(chunk):
+                tasks.append((index, factor, chunk, targets, reverse))
+    with SharedArrays({item.name: getattr(graph, item.name) for item in fields(CompactGraph)}) as spec:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=POOL_CONTEXT, initializer=_attach_graph, initargs=(spec,)
+        ) as pool:
+            results = list(pool.map(_slowed_times_worker, *zip(*[task[1:] for task in tasks])))
+    for (_, _, chunk, _, reverse), _ in zip(tasks, results):
+        increment("dijkstra_sources", len(chunk), direction="backward" if reverse else "forward")
+    parts: List[List[np.ndarray]] = [[] for _ in jobs]
+    for task, times in zip(tasks, results):
+        parts[task[0]].append(times)
+    return [np.vstack(part) if part else np.empty((0, len(job[2]))) for part, job in zip(parts, jobs)]
+
+
+def parallel_one_to_all(graph: CompactGraph, sources: np.ndarray, targets: np.ndarray, workers: int):
+    chunks = np.array_split(sources, min(len(sources), workers * 4))
+    with SharedArrays({item.name: getattr(graph, item.name) for item in fields(CompactGraph)}) as spec:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=POOL_CONTEXT, initializer=_attach_graph, initargs=(spec,)
+        ) as pool:
+            results = list(pool.map(_one_to_all_worker, chunks, [targets] * len(chunks)))
+    times = np.vstack([r[0] for r in results])
+    lengths = np.vstack([r[1] for r in results])
+    trees = [tree for r in results for tree in r[2]]
+    return times, lengths, trees
+
+
+def matrix_from_nodes(
+    graph: CompactGraph,
+    nodes: np.ndarray,
+    workers: Optional[int] = None,
+    cache: Optional[CostCache] = None,
+) -> TravelMatrix:
+    nodes = np.asarray(nodes, dtype=np.int32)
+    unique, inverse = np.unique(nodes, return_inverse=True)
+    osm_ids = graph.node_ids[unique]
+    if cache is not None:
+        times, lengths, found = cache.lookup(osm_ids, osm_ids)
+    else:
+        times = np.empty((len(unique), len(unique)))
+        lengths = np.empty((len(unique), len(unique)))
+        found = np.zeros((len(unique), len(unique)), dtype=bool)
+    trees: List[Optional[PathTree]] = [None] * len(unique)
+    missing = np.flatnonzero(~found.any(axis=1))
+    if missing.size:
+        workers = MATRIX_WORKERS if workers is None else workers
+        if workers > 1 and missing.size > SOURCE_CHUNK:
+            computed = parallel_one_to_all(graph, unique[missing], unique, workers)
+        else:
+            computed = one_to_all(graph, unique[missing], unique)
+        times[missing], lengths[missing] = computed[0], computed[1]
+        found[missing] = True
+        for row, tree in zip(missing, computed[2]):
+            trees[row] = tree
+        if cache is not None:
+            cache.store(osm_ids[missing], osm_ids, computed[0], computed[1])
+    # rows that were partly cached only lack the columns of nodes seen for the first time
+    columns = np.flatnonzero(~found.all(axis=0))
+    if columns.size:
+        column_times, column_lengths = all_to_one(graph, unique[columns], unique)
+        times[:, columns], lengths[:, columns] = column_times, column_lengths
+        if cache is not None:
+            cache.store(osm_ids, osm_ids[columns], column_times, column_lengths)
+    return TravelMatrix(
+        nodes=nodes,
+        distance=lengths[np.ix_(inverse, inverse)],
+        travel_time=times[np.ix_(inverse, inverse)],
+        trees=[trees[i] for i in inverse],
+        graph=graph,
+        cache=cache,
+    )
+
+
+def extend_matrix(previous: TravelMatrix, nodes: np.ndarray, cache: Optional[CostCache] = None) -> TravelMatrix:
+    graph = previous.graph
+    nodes = np.asarray(nodes, dtype=np.int32)
+    known, first = np.unique(previous.nodes, return_index=True)
+    at = np.minimum(np.searchsorted(known, nodes), len(known) - 1)
+    reused = known[at] == nodes
+    rows = first[at]
+    size = len(nodes)
+    distance = np.empty((size, size))
+    travel_time = np.empty((size, size))
+    old = np.flatnonzero(reused)
+    distance[np.ix_(old, old)] = previous.distance[np.ix_(rows[old], rows[old])]
+    travel_time[np.ix_(old, old)] = previous.travel_time[np.ix_(rows[old], rows[old])]
+    trees = [previous.trees[row] if ok and previous.trees else None for row, ok in zip(rows, reused)]
+    fresh, fresh_inverse = np.unique(nodes[~reused], return_inverse=True)
+    if fresh.size:
+        unique, inverse = np.unique(nodes, return_inverse=True)
+        out_times, out_lengths, out_trees = one_to_all(graph, fresh, unique)
+        in_times, in_lengths = all_to_one(graph, fresh, unique)
+        new = np.flatnonzero(~reused)
+        distance[new] = out_lengths[fresh_inverse][:, inverse]
+        travel_time[new] = out_times[fresh_inverse][:, inverse]
+        distance[:, new] = in_lengths[inverse][:, fresh_inverse]
+        travel_time[:, new] = in_times[inverse][:, fresh_inverse]
+        for row, index in zip(new, fresh_inverse):
+            trees[row] = out_trees[index]
+        if cache is not None:
+            osm_ids = graph.node_ids[unique]
+            cache.store(graph.node_ids[fresh], osm_ids, out_times, out_lengths)
+            cache.store(osm_ids, graph.node_ids[fresh], in_times, in_lengths)
+    return TravelMatrix(
+        nodes=nodes,
+        distance=distance,
+        travel_time=travel_time,
+        trees=trees,
+        graph=graph,
+        cache=cache,
+    )
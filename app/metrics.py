@@ -0,0 +1,108 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+PREFIX = "cvrptw"
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+HELP = {
+    "solves": "Finished solves",
+    "solve": "Wall time of a whole solve",
+    "batch": "Solving all scenarios of a batch over the shared matrix",
+    "snap": "Snapping points to graph nodes",
+    "cost_matrix": "Building the travel matrix through a cost provider",
+    "time_buckets": "Building per-hour travel time matrices",
+    "dijkstra_sources": "Shortest path searches run to fill matrix rows or columns",
+    "cost_cache_lookups": "Matrix entries looked up in the cost cache",
+    "cost_cache_path_lookups": "Route geometries looked up in the cost cache",
+    "geocode_lookups": "Addresses looked up in the geocode store",
+    "geocode_requests": "Requests sent to the geocoder",
+    "operator": "Destroy and repair operator calls",
+    "search": "ALNS search loop",
+    "materialize": "Turning a solution into routes",
+    "serialize": "Encoding a solve result as JSON",
+}
+
+_lock = threading.Lock()
+_counters: Dict[Key, float] = {}
+_timers: Dict[Key, Tuple[int, float]] = {}
+
+
+def label_key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    key = label_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, count: int = 1, **labels):
+    key = label_key(name, labels)
+    with _lock:
+        calls, total = _timers.get(key, (0, 0.0))
+        _timers[key] = (calls + count, total + seconds)
+
+
+@dataclass(slots=True)
+class Timing:
+    seconds: float = 0.0
+
+
+@contextmanager
+def timer(name: str, **labels):
+    timing = Timing()
+    started = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.seconds = time.perf_counter() - started
+        observe(name, timing.seconds, **labels)
+
+
+def hit_rate(name: str) -> float:
+    with _lock:
+        hits = sum(value for (key, labels), value in _counters.items() if key == name and ("result", "hit") in labels)
+        total = sum(value for (key, _), value in _counters.items() if key == name)
+    return hits / total if total else 0.0
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def render_prometheus() -> str:
+    with _lock:
+        counters = dict(_counters)
+        timers = dict(_timers)
+    lines = []
+    for name in sorted({key for key, _ in counters}):
+        metric = f"{PREFIX}_{name}_total"
+        lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} counter")
+        for (key, labels), value in sorted(counters.items()):
+            if key == name:
+                lines.append(f"{metric}{format_labels(labels)} {value!r}")
+    for name in sorted({key for key, _ in timers}):
+        metric = f"{PREFIX}_{name}_seconds"
+        lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} summary")
+        for (key, labels), (count, total) in sorted(timers.items()):
+            if key == name:
+                lines.append(f"{metric}_count{format_labels(labels)} {count}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {total:.6f}")
+    for name in ("cost_cache_lookups", "geocode_lookups"):
+        metric = f"{PREFIX}_{name.replace('_lookups', '')}_hit_ratio"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {hit_rate(name):.4f}")
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Boolean, DateTime, Text, Index
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -18,21 +18,71 @@ class Order(Base):
     __tablename__ = "orders"
 
     id = Column(Integer, primary_key=True)
-    external_id = Column(String, nullable=False)
+    external_id = Column(String, nullable=False, index=True)
     address = Column(String)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     volume = Column(Float, nullable=False)
     window_start = Column(Float, nullable=True)
     window_end = Column(Float, nullable=True)
+    node_id = Column(BigInteger, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (Index("ix_orders_lat_lon", "latitude", "longitude"),)
+
 
 class Depot(Base):
     __tablename__ = "depot"
 
     id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=True)
     address = Column(String)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
+    node_id = Column(BigInteger, nullable=True)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SolveJob(Base):
+    __tablename__ = "solve_jobs"
+
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="queued")
+    params = Column(Text)
+    progress = Column(Float, default=0.0)
+    iteration = Column(Integer, default=0)
+    best_cost = Column(Float, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(String, nullable=True)
+    owner_pid = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SavedPlan(Base):
+    __tablename__ = "saved_plans"
+
+    key = Column(String, primary_key=True)
+    routes = Column(Text, nullable=False)
+    cost = Column(Float, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class TableRevision(Base):
+    __tablename__ = "table_revisions"
+
+    name = Column(String, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
+
+def get_revision(session, name: str) -> int:
+    row = session.get(TableRevision, name)
+    return row.revision if row else 0
+
+
+def bump_revision(session, name: str):
+    row = session.get(TableRevision, name)
+    if row is None:
+        session.add(TableRevision(name=name, revision=1))
+    else:
+        row.revision = TableRevision.revision + 1
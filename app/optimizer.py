@@ -1,11 +1,27 @@
 import math
-import random
+import time
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
-from .graph import get_graph, shortest_path_info
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
+import numpy as np
+from .costs import CostProvider, GraphCostProvider
+from .matrix import TravelMatrix
+from .metrics import observe, timer
+from .routestate import LATE_PENALTY, RouteState
 
+UNASSIGNED_PENALTY = 1e7
+# Ropke & Pisinger scores: new global best, improved current, accepted worse
+SCORE_BEST = 33.0
+SCORE_IMPROVED = 9.0
+SCORE_ACCEPTED = 13.0
+REACTION = 0.1
+SEGMENT = 50
+# rows of the request-to-request cost matrix ranked at once when building neighbour lists
+NEIGHBOUR_BLOCK = 1024
+# Solomon's lambda: weight of the depot round trip a request would otherwise need in the I1 criterion
+I1_LAMBDA = 2.0
 
-@dataclass
+
+@dataclass(slots=True)
 class Request:
     id: int
     external_id: str
@@ -14,157 +30,554 @@ class Request:
     location: Tuple[float, float]
 
 
-@dataclass
+@dataclass(slots=True)
 class VehicleProfile:
     id: int
     name: str
     capacity: float
 
 
-@dataclass
+@dataclass(slots=True)
 class Route:
     vehicle: VehicleProfile
     stops: List[int]
     distance: float
     travel_time: float
-    geometry: List[List[Tuple[float, float]]]
+    rows: List[int]
+
+
+@dataclass(slots=True)
+class Solution:
+    stops: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_routes(cls, routes: Sequence[Sequence[int]]) -> "Solution":
+        offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum([len(route) for route in routes], out=offsets[1:])
+        stops = np.fromiter((stop for route in routes for stop in route), dtype=np.int32, count=int(offsets[-1]))
+        return cls(stops=stops, offsets=offsets)
+
+    def route(self, vehicle: int) -> np.ndarray:
+        return self.stops[self.offsets[vehicle]:self.offsets[vehicle + 1]]
+
+    def routes(self) -> List[List[int]]:
+        return [self.route(v).tolist() for v in range(len(self.offsets) - 1)]
+
+    def vehicle_of(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+
+    def copy(self) -> "Solution":
+        return Solution(stops=self.stops.copy(), offsets=self.offsets.copy())
+
+
+@dataclass(slots=True)
+class OperatorStats:
+    name: str
+    weight: float = 1.0
+    calls: int = 0
+    accepted: int = 0
+    improved: int = 0
+    best: int = 0
+    seconds: float = 0.0
+    segment_score: float = 0.0
+    segment_calls: int = 0
+
+    def reward(self, score: float):
+        self.segment_score += score
+
+    def adapt(self):
+        if self.segment_calls:
+            self.weight = (1 - REACTION) * self.weight + REACTION * self.segment_score / self.segment_calls
+        self.weight = max(self.weight, 0.01)
+        self.segment_score = 0.0
+        self.segment_calls = 0
+
+    def merge(self, other: "OperatorStats"):
+        self.calls += other.calls
+        self.accepted += other.accepted
+        self.improved += other.improved
+        self.best += other.best
+        self.seconds += other.seconds
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "calls": self.calls,
+            "accepted": self.accepted,
+            "improved": self.improved,
+            "best": self.best,
+            "seconds": self.seconds,
+        }
+
+
+def neighbour_lists(
+    matrix: TravelMatrix,
+    matrix_index: np.ndarray,
+    window_start: np.ndarray,
+    window_end: np.ndarray,
+    k: int,
+) -> np.ndarray:
+    n = len(matrix_index)
+    k = min(k, n - 1)
+    lists = np.full((n, k), -1, dtype=np.int64)
+    if k <= 0:
+        return lists
+    there = matrix_index[None, :]
+    for lo in range(0, n, NEIGHBOUR_BLOCK):
+        rows = np.arange(lo, min(lo + NEIGHBOUR_BLOCK, n))
+        here = matrix_index[rows][:, None]
+        # a pair is only related in a direction that can be driven without missing the second window
+        follows = window_start[rows][:, None] + matrix.travel_time[here, there] <= window_end[None, :]
+        precedes = window_start[None, :] + matrix.travel_time[there, here] <= window_end[rows][:, None]
+        cost = np.minimum(
+            np.where(follows, matrix.distance[here, there], np.inf),
+            np.where(precedes, matrix.distance[there, here], np.inf),
+        )
+        cost[np.arange(len(rows)), rows] = np.inf
+        nearest = np.argpartition(cost, k - 1, axis=1)[:, :k]
+        lists[rows] = np.where(np.isfinite(np.take_along_axis(cost, nearest, axis=1)), nearest, -1)
+    return lists
 
 
 class CVRPTWOptimizer:
-    def __init__(self, depot: Tuple[float, float], requests: List[Request], vehicles: List[VehicleProfile]):
+    def __init__(
+        self,
+        depot: Tuple[float, float],
+        requests: List[Request],
+        vehicles: List[VehicleProfile],
+        matrix: Optional[TravelMatrix] = None,
+        matrix_workers: Optional[int] = None,
+        matrix_index: Optional[Sequence[int]] = None,
+        depot_index: int = 0,
+        seed: Optional[int] = None,
+        node_ids: Optional[Sequence[Optional[int]]] = None,
+        costs: Optional[CostProvider] = None,
+        neighbours: Optional[int] = None,
+    ):
         self.depot = depot
         self.requests = requests
         self.vehicles = vehicles
-        self.graph = get_graph()
-        self.distance_cache: Dict[Tuple[int, int], Tuple[float, float, List[Tuple[float, float]]]] = {}
-
-    def compute_cost(self, from_loc: Tuple[float, float], to_loc: Tuple[float, float]) -> Tuple[float, float, List[Tuple[float, float]]]:
-        key = (hash(from_loc), hash(to_loc))
-        if key in self.distance_cache:
-            return self.distance_cache[key]
-        info = shortest_path_info(self.graph, from_loc, to_loc)
-        result = (info["distance"], info["travel_time"], info["path"])
-        self.distance_cache[key] = result
-        return result
-
-    def initial_solution(self):
-        sorted_requests = sorted(self.requests, key=lambda r: r.window[0])
-        routes = [[] for _ in self.vehicles]
-        loads = [0 for _ in self.vehicles]
-        for request in sorted_requests:
-            best_idx = None
-            for idx, vehicle in enumerate(self.vehicles):
-                if loads[idx] + request.volume <= vehicle.capacity:
-                    best_idx = idx
-                    break
-            if best_idx is None:
+        if matrix is None:
+            costs = costs if costs is not None else GraphCostProvider()
+            matrix = costs.matrix([depot] + [r.location for r in requests], node_ids, matrix_workers)
+        self.matrix = matrix
+        self.position: Dict[int, int] = {r.id: pos for pos, r in enumerate(requests)}
+        self.ids = np.array([r.id for r in requests], dtype=np.int64)
+        self.volumes = np.array([r.volume for r in requests], dtype=np.float64)
+        self.window_start = np.array([r.window[0] if r.window[0] is not None else 0.0 for r in requests], dtype=np.float64)
+        self.window_end = np.array([r.window[1] if r.window[1] is not None else np.inf for r in requests], dtype=np.float64)
+        if matrix_index is None:
+            matrix_index = np.arange(1, len(requests) + 1)
+        self.matrix_index = np.asarray(matrix_index, dtype=np.int64)
+        self.depot_index = depot_index
+        self.capacities = np.array([v.capacity for v in vehicles], dtype=np.float64)
+        self.neighbour_count = neighbours
+        self._distance_scale: Optional[float] = None
+        self.neighbour_lists: Optional[np.ndarray] = None
+        self.neighbours: Optional[np.ndarray] = None
+        if neighbours and neighbours < len(requests) - 1:
+            self.neighbour_lists = neighbour_lists(matrix, self.matrix_index, self.window_start, self.window_end, neighbours)
+            self.neighbours = np.zeros((len(requests), len(requests)), dtype=bool)
+            rows = np.repeat(np.arange(len(requests)), self.neighbour_lists.shape[1])
+            found = self.neighbour_lists.ravel() >= 0
+            self.neighbours[rows[found], self.neighbour_lists.ravel()[found]] = True
+        self.rng = np.random.default_rng(seed)
+        self.destroy_operators: Dict[str, Callable[[Solution, int], Tuple[Solution, np.ndarray]]] = {
+            "random": self.random_destroy,
+            "shaw": self.shaw_destroy,
+            "worst": self.worst_destroy,
+            "route": self.route_destroy,
+            "time": self.time_destroy,
+        }
+        self.repair_operators: Dict[str, Callable[[Solution, np.ndarray], Solution]] = {
+            "greedy": self.greedy_repair,
+            "regret-2": lambda solution, removed: self.regret_repair(solution, removed, 2),
+            "regret-3": lambda solution, removed: self.regret_repair(solution, removed, 3),
+        }
+        self.operator_stats = {name: OperatorStats(name) for name in [*self.destroy_operators, *self.repair_operators]}
+        self.temperature = 1000.0
+        self.min_fraction = 0.1
+        self.max_fraction = 0.3
+        self.iterations_done = 0
+        self.best_cost = math.inf
+        self.unplaced: List[int] = []
+        self.trace: List[Tuple[int, float, float]] = []
+        self.timings: Dict[str, float] = {}
+
+    def compute_cost(self, origin: int, destination: int, departure: float = 0.0) -> Tuple[float, float]:
+        return float(self.matrix.distance[origin, destination]), self.matrix.leg_time(origin, destination, departure)
+
+    def initial_solution(self) -> Solution:
+        # Solomon's I1 insertion, one route at a time: seed with the farthest request, then keep adding the
+        # request whose cheapest on-time insertion saves most against serving it from the depot alone
+        pending = np.arange(len(self.requests))
+        reach = self.matrix.distance[self.depot_index, self.matrix_index]
+        routes: List[List[int]] = [[] for _ in self.vehicles]
+        for v_idx in np.argsort(-self.capacities, kind="stable"):
+            candidates = pending[self.volumes[pending] <= self.capacities[v_idx]]
+            if not candidates.size:
                 continue
-            routes[best_idx].append(request.id)
-            loads[best_idx] += request.volume
-        return routes
+            seed = int(candidates[np.argmax(np.where(np.isfinite(reach[candidates]), reach[candidates], -1.0))])
+            state = RouteState(self, [seed], self.capacities[v_idx])
+            pending = pending[pending != seed]
+            # a route only gets longer and fuller, so a request that no longer fits is not priced again
+            open_ = pending
+            while open_.size:
+                costs = state.insertion_matrix(open_, np.ones(len(open_), dtype=bool), exact=False)
+                where = costs.argmin(axis=1)
+                added = costs[np.arange(len(open_)), where]
+                on_time = added < LATE_PENALTY
+                if not on_time.any():
+                    break
+                open_, where, added = open_[on_time], where[on_time], added[on_time]
+                pick = int(np.argmax(I1_LAMBDA * reach[open_] - added))
+                state.insert(int(where[pick]), int(open_[pick]))
+                open_ = np.delete(open_, pick)
+            pending = pending[~np.isin(pending, state.stops)]
+            routes[v_idx] = state.stops
+        solution = Solution.from_routes(routes)
+        if pending.size:
+            # requests no route can reach on time still go wherever they cost least; only those over capacity stay out
+            solution = self.regret_repair(solution, pending)
+        return solution
+
+    def unassigned(self, solution: Solution) -> np.ndarray:
+        placed = np.zeros(len(self.requests), dtype=bool)
+        placed[solution.stops] = True
+        return np.flatnonzero(~placed)
+
+    def warm_solution(self, previous: Dict[int, Sequence[int]]) -> Solution:
+        placed = np.zeros(len(self.requests), dtype=bool)
+        routes: List[List[int]] = []
+        # routes of vehicles left out of this solve are dropped and their orders go back through repair
+        for vehicle in self.vehicles:
+            route: List[int] = []
+            load = 0.0
+            for order_id in previous.get(vehicle.id, ()):
+                pos = self.position.get(order_id)
+                if pos is None or placed[pos] or load + self.volumes[pos] > vehicle.capacity:
+                    continue
+                route.append(pos)
+                load += self.volumes[pos]
+                placed[pos] = True
+            routes.append(route)
+        return self.regret_repair(Solution.from_routes(routes), np.flatnonzero(~placed))
 
-    def route_cost(self, route: List[int]) -> Tuple[float, float]:
+    def route_cost(self, route: Sequence[int]) -> Tuple[float, float]:
         distance = 0.0
         time = 0.0
-        prev = self.depot
-        for req_id in route:
-            req = next(r for r in self.requests if r.id == req_id)
-            d, t, _ = self.compute_cost(prev, req.location)
+        prev = self.depot_index
+        for pos in route:
+            node = self.matrix_index[pos]
+            d, t = self.compute_cost(prev, node, time)
             distance += d
             time += t
-            if req.window[0] is not None and time < req.window[0]:
-                time = req.window[0]
-            if req.window[1] is not None and time > req.window[1]:
-                distance += 1e6
-            prev = req.location
-        d, t, _ = self.compute_cost(prev, self.depot)
+            if time < self.window_start[pos]:
+                time = self.window_start[pos]
+            if time > self.window_end[pos]:
+                distance += LATE_PENALTY
+            prev = node
+        d, t = self.compute_cost(prev, self.depot_index, time)
         return distance + d, time + t
 
-    def random_destroy(self, routes: List[List[int]], remove_fraction: float = 0.2):
-        flat = [r for route in routes for r in route]
-        remove_count = max(1, int(len(flat) * remove_fraction))
-        to_remove = set(random.sample(flat, remove_count))
-        new_routes = []
-        removed = []
-        for route in routes:
-            remaining = [r for r in route if r not in to_remove]
-            removed.extend([r for r in route if r in to_remove])
-            new_routes.append(remaining)
-        return new_routes, removed
-
-    def greedy_repair(self, routes: List[List[int]], removed: List[int]):
-        remaining = removed.copy()
-        random.shuffle(remaining)
-        for req_id in remaining:
-            request = next(r for r in self.requests if r.id == req_id)
-            best_vehicle = None
-            best_position = None
-            best_cost = math.inf
-            for v_idx, vehicle in enumerate(self.vehicles):
-                route = routes[v_idx]
-                load = sum(next(r.volume for r in self.requests if r.id == rid) for rid in route)
-                if load + request.volume > vehicle.capacity:
-                    continue
-                for pos in range(len(route) + 1):
-                    new_route = route[:pos] + [req_id] + route[pos:]
-                    dist, _ = self.route_cost(new_route)
-                    if dist < best_cost:
-                        best_cost = dist
-                        best_vehicle = v_idx
-                        best_position = pos
+    def random_destroy(self, solution: Solution, remove_count: int):
+        remove_count = min(remove_count, len(solution.stops))
+        removed_at = self.rng.choice(len(solution.stops), size=remove_count, replace=False)
+        return self.remove(solution, removed_at)
+
+    def distance_scale(self) -> float:
+        if self._distance_scale is None:
+            scale = 0.0
+            for lo in range(0, len(self.matrix_index), NEIGHBOUR_BLOCK):
+                block = self.matrix.distance[np.ix_(self.matrix_index[lo:lo + NEIGHBOUR_BLOCK], self.matrix_index)]
+                finite = block[np.isfinite(block)]
+                if finite.size:
+                    scale = max(scale, float(finite.max()))
+            self._distance_scale = scale if scale > 0 else 1.0
+        return self._distance_scale
+
+    def shaw_destroy(self, solution: Solution, remove_count: int, randomness: float = 6.0):
+        remove_count = min(remove_count, len(solution.stops))
+        nodes = self.matrix_index[solution.stops]
+        distance = self.matrix.distance
+        scale_d = self.distance_scale()
+        opens = self.window_start[solution.stops]
+        scale_t = max(np.ptp(opens), 1.0)
+        volumes = self.volumes[solution.stops]
+        scale_q = max(np.ptp(volumes), 1.0)
+        chosen = [int(self.rng.integers(len(solution.stops)))]
+        available = np.ones(len(solution.stops), dtype=bool)
+        available[chosen[0]] = False
+        while len(chosen) < remove_count:
+            ref = chosen[int(self.rng.integers(len(chosen)))]
+            relatedness = (
+                9 * np.minimum(distance[nodes[ref], nodes], distance[nodes, nodes[ref]]) / scale_d
+                + 3 * np.abs(opens - opens[ref]) / scale_t
+                + 2 * np.abs(volumes - volumes[ref]) / scale_q
+            )
+            candidates = np.flatnonzero(available)
+            if self.neighbours is not None:
+                # relatedness is only ranked among the reference's granular neighbours while any remain
+                near = candidates[self.neighbours[solution.stops[ref], solution.stops[candidates]]]
+                candidates = near if near.size else candidates
+            ranked = candidates[np.argsort(relatedness[candidates], kind="stable")]
+            pick = int(ranked[int(self.rng.random() ** randomness * len(ranked))])
+            chosen.append(pick)
+            available[pick] = False
+        return self.remove(solution, np.array(chosen))
+
+    def worst_destroy(self, solution: Solution, remove_count: int, randomness: float = 3.0):
+        remove_count = min(remove_count, len(solution.stops))
+        gains = np.concatenate([state.removal_gains() for state in self.route_states(solution)])
+        ranked = list(np.argsort(-gains, kind="stable"))
+        chosen = [ranked.pop(int(self.rng.random() ** randomness * len(ranked))) for _ in range(remove_count)]
+        return self.remove(solution, np.array(chosen))
+
+    def route_destroy(self, solution: Solution, remove_count: int):
+        lengths = np.diff(solution.offsets)
+        used = np.flatnonzero(lengths)
+        removed_at: List[int] = []
+        for vehicle in self.rng.permutation(used):
+            if len(removed_at) >= remove_count:
+                break
+            removed_at.extend(range(solution.offsets[vehicle], solution.offsets[vehicle + 1]))
+        return self.remove(solution, np.array(removed_at, dtype=np.int64))
+
+    def time_destroy(self, solution: Solution, remove_count: int):
+        remove_count = min(remove_count, len(solution.stops))
+        starts = np.concatenate([state.start[1:-1] for state in self.route_states(solution)])
+        ref = starts[int(self.rng.integers(len(starts)))]
+        chosen = np.argpartition(np.abs(starts - ref), remove_count - 1)[:remove_count]
+        return self.remove(solution, chosen)
+
+    def remove(self, solution: Solution, removed_at: np.ndarray):
+        keep = np.ones(len(solution.stops), dtype=bool)
+        keep[removed_at] = False
+        kept_per_route = np.bincount(solution.vehicle_of()[keep], minlength=len(self.vehicles))
+        offsets = np.zeros(len(self.vehicles) + 1, dtype=np.int64)
+        np.cumsum(kept_per_route, out=offsets[1:])
+        return Solution(stops=solution.stops[keep], offsets=offsets), solution.stops[~keep]
+
+    def route_states(self, solution: Solution) -> List[RouteState]:
+        return [RouteState(self, solution.route(v).tolist(), vehicle.capacity) for v, vehicle in enumerate(self.vehicles)]
+
+    def near_routes(self, pos: int, route_of: np.ndarray) -> Sequence[int]:
+        if self.neighbour_lists is None:
+            return range(len(self.vehicles))
+        routed = route_of[route_of >= 0]
+        empty = np.flatnonzero(np.bincount(routed, minlength=len(self.vehicles)) == 0)
+        # empty routes of the same capacity price a request identically, one of each is enough
+        empty = empty[np.unique(self.capacities[empty], return_index=True)[1]]
+        used = route_of[self.neighbour_lists[pos][self.neighbour_lists[pos] >= 0]]
+        return np.union1d(used[used >= 0], empty).tolist()
+
+    def best_insertion(self, states: List[RouteState], pos: int, vehicles: Sequence[int], everywhere: bool = False):
+        best_vehicle = None
+        best_position = None
+        best_cost = math.inf
+        for v_idx in vehicles:
+            costs = states[v_idx].insertion_costs(pos, everywhere)
+            if costs is None:
+                continue
+            at = int(np.argmin(costs))
+            if costs[at] < best_cost:
+                best_cost = costs[at]
+                best_vehicle = v_idx
+                best_position = at
+        return best_vehicle, best_position
+
+    def greedy_repair(self, solution: Solution, removed: np.ndarray) -> Solution:
+        remaining = removed.tolist()
+        self.rng.shuffle(remaining)
+        states = self.route_states(solution)
+        route_of = np.full(len(self.requests), -1, dtype=np.int64)
+        route_of[solution.stops] = solution.vehicle_of()
+        for pos in remaining:
+            best_vehicle, best_position = self.best_insertion(states, pos, self.near_routes(pos, route_of))
+            if best_vehicle is None and self.neighbours is not None:
+                # nothing fits next to a neighbour, so try every position before leaving the request out
+                best_vehicle, best_position = self.best_insertion(states, pos, range(len(states)), everywhere=True)
             if best_vehicle is None:
                 continue
-            routes[best_vehicle].insert(best_position, req_id)
-        return routes
+            states[best_vehicle].insert(best_position, pos)
+            route_of[pos] = best_vehicle
+        return Solution.from_routes([state.stops for state in states])
 
-    def solution_cost(self, routes: List[List[int]]):
-        return sum(self.route_cost(route)[0] for route in routes)
+    def regret_repair(self, solution: Solution, removed: np.ndarray, k: int = 2) -> Solution:
+        states = self.route_states(solution)
+        pending = np.asarray(removed, dtype=np.int64)
+        everywhere = np.zeros(len(pending), dtype=bool)
+        best = np.empty((len(pending), len(states)))
+        where = np.empty((len(pending), len(states)), dtype=np.int64)
+        for v_idx, state in enumerate(states):
+            costs = state.insertion_matrix(pending)
+            where[:, v_idx] = costs.argmin(axis=1)
+            best[:, v_idx] = costs[np.arange(len(pending)), where[:, v_idx]]
+        if self.neighbours is not None:
+            # requests with no usable position next to a neighbour are priced over every position
+            everywhere = ~np.isfinite(best).any(axis=1)
+            if everywhere.any():
+                stuck = np.flatnonzero(everywhere)
+                for v_idx, state in enumerate(states):
+                    costs = state.insertion_matrix(pending[stuck], everywhere[stuck])
+                    where[stuck, v_idx] = costs.argmin(axis=1)
+                    best[stuck, v_idx] = costs[np.arange(len(stuck)), where[stuck, v_idx]]
+        while pending.size:
+            feasible = np.isfinite(best).any(axis=1)
+            if not feasible.any():
+                break
+            ranked = np.sort(best, axis=1)
+            first = ranked[:, :1]
+            second = ranked[:, 1:k]
+            # a request with fewer than k usable routes gets the largest regret; unusable rows skip inf - inf
+            gaps = np.where(np.isfinite(second), second - np.where(feasible[:, None], first, 0.0), UNASSIGNED_PENALTY)
+            regret = np.where(feasible, gaps.sum(axis=1), -np.inf)
+            pick = np.lexsort((first[:, 0], -regret))[0]
+            v_idx = int(np.argmin(best[pick]))
+            states[v_idx].insert(int(where[pick, v_idx]), int(pending[pick]))
+            keep = np.arange(len(pending)) != pick
+            pending, best, where, everywhere = pending[keep], best[keep], where[keep], everywhere[keep]
+            if pending.size:
+                costs = states[v_idx].insertion_matrix(pending, everywhere)
+                where[:, v_idx] = costs.argmin(axis=1)
+                best[:, v_idx] = costs[np.arange(len(pending)), where[:, v_idx]]
+        return Solution.from_routes([state.stops for state in states])
 
-    def optimize(self, iterations: int = 200):
-        current = self.initial_solution()
+    def solution_cost(self, solution: Solution) -> float:
+        routed = sum(state.cost for state in self.route_states(solution))
+        return routed + UNASSIGNED_PENALTY * (len(self.requests) - len(solution.stops))
+
+    def select(self, names: List[str], stats: Dict[str, OperatorStats]) -> str:
+        weights = np.array([stats[name].weight for name in names])
+        return names[int(self.rng.choice(len(names), p=weights / weights.sum()))]
+
+    def search(
+        self,
+        start: Solution,
+        iterations: Optional[int] = None,
+        time_limit: Optional[float] = None,
+        min_fraction: Optional[float] = None,
+        max_fraction: Optional[float] = None,
+        cooling: float = 0.995,
+        progress: Optional[Callable[[int, float], bool]] = None,
+    ) -> Tuple[Solution, float]:
+        stats = self.operator_stats
+        min_fraction = self.min_fraction if min_fraction is None else min_fraction
+        max_fraction = self.max_fraction if max_fraction is None else max_fraction
+        deadline = time.monotonic() + time_limit if time_limit is not None else math.inf
+        current = start
+        current_cost = self.solution_cost(current)
         best = current
-        best_cost = self.solution_cost(best)
-        temperature = 1000
-        cooling = 0.995
-        for _ in range(iterations):
-            destroyed, removed = self.random_destroy(current)
-            candidate = self.greedy_repair(destroyed, removed)
+        best_cost = current_cost
+        iteration = 0
+        while (iterations is None or iteration < iterations) and time.monotonic() < deadline:
+            if not current.stops.size:
+                break
+            low = max(1, int(len(current.stops) * min_fraction))
+            high = max(low, int(len(current.stops) * max_fraction))
+            remove_count = int(self.rng.integers(low, high + 1))
+            destroy_name = self.select(list(self.destroy_operators), stats)
+            repair_name = self.select(list(self.repair_operators), stats)
+            started = time.perf_counter()
+            destroyed, removed = self.destroy_operators[destroy_name](current, remove_count)
+            destroy_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            candidate = self.repair_operators[repair_name](destroyed, removed)
+            repair_seconds = time.perf_counter() - started
+            stats[destroy_name].seconds += destroy_seconds
+            stats[repair_name].seconds += repair_seconds
+            observe("operator", destroy_seconds, operator=destroy_name, kind="destroy")
+            observe("operator", repair_seconds, operator=repair_name, kind="repair")
             candidate_cost = self.solution_cost(candidate)
-            delta = candidate_cost - best_cost
-            if delta < 0 or math.exp(-delta / temperature) > random.random():
+            delta = candidate_cost - current_cost
+            score = 0.0
+            accepted = delta < 0 or math.exp(-delta / self.temperature) > self.rng.random()
+            if accepted:
                 current = candidate
+                current_cost = candidate_cost
+                score = SCORE_IMPROVED if delta < 0 else SCORE_ACCEPTED
                 if candidate_cost < best_cost:
                     best = candidate
                     best_cost = candidate_cost
-            temperature *= cooling
-        return self.materialize(best)
+                    score = SCORE_BEST
+            for name in (destroy_name, repair_name):
+                op = stats[name]
+                op.calls += 1
+                op.segment_calls += 1
+                op.accepted += accepted
+                op.improved += accepted and delta < 0
+                op.best += score == SCORE_BEST
+                op.reward(score)
+            iteration += 1
+            self.trace.append((iteration, current_cost, best_cost))
+            if iteration % SEGMENT == 0:
+                for op in stats.values():
+                    op.adapt()
+            self.temperature *= cooling
+            if progress is not None and progress(iteration, best_cost) is False:
+                break
+        self.iterations_done = iteration
+        return best, best_cost
+
+    def optimize(
+        self,
+        iterations: Optional[int] = 200,
+        time_limit: Optional[float] = None,
+        workers: int = 1,
+        progress: Optional[Callable[[int, float], bool]] = None,
+        start: Optional[Solution] = None,
+        decompose: Optional[str] = None,
+        cluster_size: Optional[int] = None,
+    ):
+        if iterations is None and time_limit is None:
+            iterations = 200
+        if start is None and decompose is None:
+            start = self.initial_solution()
+        with timer("search", workers=workers) as timing:
+            if decompose is not None:
+                from .decompose import CLUSTER_SIZE, decomposed_search
 
-    def materialize(self, routes: List[List[int]]):
+                best, _ = decomposed_search(
+                    self, decompose, workers, iterations, time_limit, progress, cluster_size or CLUSTER_SIZE, start
+                )
+            elif workers > 1:
+                from .parallel import parallel_search
+
+                best, _ = parallel_search(self, workers, iterations, time_limit, progress, start)
+            else:
+                best, _ = self.search(start, iterations, time_limit, progress=progress)
+        self.timings["search"] = timing.seconds
+        self.best_cost = self.solution_cost(best)
+        self.unplaced = self.ids[self.unassigned(best)].tolist()
+        with timer("materialize") as timing:
+            routes = self.materialize(best)
+        self.timings["materialize"] = timing.seconds
+        return routes
+
+    def operator_summary(self):
+        return [op.summary() for op in self.operator_stats.values()]
+
+    def materialize(self, solution: Solution):
         materialized = []
-        for route, vehicle in zip(routes, self.vehicles):
-            distance = 0
-            travel_time = 0
-            geometry_segments: List[List[Tuple[float, float]]] = []
-            prev_loc = self.depot
-            for req_id in route:
-                req = next(r for r in self.requests if r.id == req_id)
-                d, t, path = self.compute_cost(prev_loc, req.location)
-                distance += d
-                travel_time += t
-                geometry_segments.append(path)
-                prev_loc = req.location
-            d, t, path = self.compute_cost(prev_loc, self.depot)
-            if route:
-                geometry_segments.append(path)
-            distance += d
-            travel_time += t
+        for v_idx, vehicle in enumerate(self.vehicles):
+            route = solution.route(v_idx)
+            rows = [self.depot_index, *self.matrix_index[route].tolist(), self.depot_index]
+            distance = 0.0
+            travel_time = 0.0
+            if len(route):
+                state = RouteState(self, route.tolist(), vehicle.capacity)
+                distance = state.distance
+                # driving time only: legs depart when service starts, waiting for a window is excluded
+                travel_time = float((state.arrival[1:] - state.start[:-1]).sum())
             materialized.append(
                 Route(
                     vehicle=vehicle,
-                    stops=route,
+                    stops=self.ids[route].tolist(),
                     distance=distance,
                     travel_time=travel_time,
-                    geometry=geometry_segments,
+                    rows=rows if len(route) else [],
                 )
             )
         return materialized
@@ -0,0 +1,142 @@
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from .matrix import POOL_CONTEXT, SharedArrays, TimeBuckets, TravelMatrix, attach_arrays
+from .metrics import observe
+from .optimizer import CVRPTWOptimizer, OperatorStats, Solution
+
+EXCHANGE_ITERATIONS = 50
+EXCHANGE_SECONDS = 2.0
+
+_chain_optimizer: Optional[CVRPTWOptimizer] = None
+
+
+def shared_matrix(matrix: TravelMatrix) -> Tuple[Dict[str, np.ndarray], float]:
+    arrays = {"distance": matrix.distance, "travel_time": matrix.travel_time}
+    if matrix.buckets is None:
+        return arrays, 0.0
+    arrays.update(bucket_times=matrix.buckets.times, hour_bucket=matrix.buckets.hour_bucket)
+    return arrays, matrix.buckets.clock_start
+
+
+def attach_matrix(spec, clock_start: float) -> TravelMatrix:
+    arrays = attach_arrays(spec)
+    buckets = None
+    if "bucket_times" in arrays:
+        buckets = TimeBuckets(hour_bucket=arrays["hour_bucket"], times=arrays["bucket_times"], clock_start=clock_start)
+    return TravelMatrix(
+        nodes=np.arange(len(arrays["distance"]), dtype=np.int32),
+        distance=arrays["distance"],
+        travel_time=arrays["travel_time"],
+        buckets=buckets,
+    )
+
+
+def _init_chain(spec, depot, requests, vehicles, matrix_index, depot_index, clock_start, neighbours):
+    global _chain_optimizer
+    _chain_optimizer = CVRPTWOptimizer(
+        depot=depot,
+        requests=requests,
+        vehicles=vehicles,
+        matrix=attach_matrix(spec, clock_start),
+        matrix_index=matrix_index,
+        depot_index=depot_index,
+        neighbours=neighbours,
+    )
+
+
+def _run_chain(task: Dict):
+    opt = _chain_optimizer
+    opt.rng = np.random.default_rng(task["seed"])
+    opt.temperature = task["temperature"]
+    opt.trace = []
+    opt.min_fraction, opt.max_fraction = task["fractions"]
+    opt.operator_stats = {name: OperatorStats(name, weight=weight) for name, weight in task["weights"].items()}
+    best, cost = opt.search(Solution(task["stops"], task["offsets"]), task["iterations"], task["time_limit"])
+    return {
+        "stops": best.stops,
+        "offsets": best.offsets,
+        "cost": cost,
+        "temperature": opt.temperature,
+        "iterations": opt.iterations_done,
+        "stats": opt.operator_stats,
+    }
+
+
+def parallel_search(
+    optimizer: CVRPTWOptimizer,
+    workers: int,
+    iterations: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    progress: Optional[Callable[[int, float], bool]] = None,
+    start: Optional[Solution] = None,
+) -> Tuple[Solution, float]:
+    deadline = time.monotonic() + time_limit if time_limit is not None else math.inf
+    best = optimizer.initial_solution() if start is None else start
+    best_cost = optimizer.solution_cost(best)
+    base_seed = int(optimizer.rng.integers(2**31))
+    chains = [
+        {"temperature": optimizer.temperature, "weights": {name: 1.0 for name in optimizer.operator_stats}, "iterations": 0}
+        for _ in range(workers)
+    ]
+    arrays, clock_start = shared_matrix(optimizer.matrix)
+    initargs = (
+        optimizer.depot,
+        optimizer.requests,
+        optimizer.vehicles,
+        optimizer.matrix_index,
+        optimizer.depot_index,
+        clock_start,
+        optimizer.neighbour_count,
+    )
+    with SharedArrays(arrays) as spec:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_chain, initargs=(spec, *initargs)
+        ) as pool:
+            exchange = 0
+            while time.monotonic() < deadline:
+                # a round can end on its time slice before its iterations, so each chain keeps its own budget
+                running = []
+                for chain_id, chain in enumerate(chains):
+                    budget = EXCHANGE_ITERATIONS
+                    if iterations is not None:
+                        budget = min(budget, iterations - chain["iterations"])
+                    if budget > 0:
+                        running.append((chain_id, chain, budget))
+                if not running:
+                    break
+                tasks = [
+                    {
+                        "seed": [base_seed, chain_id, exchange],
+                        "stops": best.stops,
+                        "offsets": best.offsets,
+                        "iterations": budget,
+                        "time_limit": min(EXCHANGE_SECONDS, max(deadline - time.monotonic(), 0.0)),
+                        "temperature": chain["temperature"],
+                        "fractions": (optimizer.min_fraction, optimizer.max_fraction),
+                        "weights": chain["weights"],
+                    }
+                    for chain_id, chain, budget in running
+                ]
+                for (_, chain, _), result in zip(running, pool.map(_run_chain, tasks)):
+                    chain["temperature"] = result["temperature"]
+                    chain["iterations"] += result["iterations"]
+                    chain["weights"] = {name: op.weight for name, op in result["stats"].items()}
+                    for name, op in result["stats"].items():
+                        optimizer.operator_stats[name].merge(op)
+                        if op.calls:
+                            kind = "destroy" if name in optimizer.destroy_operators else "repair"
+                            observe("operator", op.seconds, count=op.calls, operator=name, kind=kind)
+                    if result["cost"] < best_cost:
+                        best = Solution(result["stops"], result["offsets"])
+                        best_cost = result["cost"]
+                exchange += 1
+                optimizer.trace.append((sum(chain["iterations"] for chain in chains), best_cost, best_cost))
+                if progress is not None and progress(sum(chain["iterations"] for chain in chains), best_cost) is False:
+                    break
+    for name, op in optimizer.operator_stats.items():
+        op.weight = float(np.mean([chain["weights"][name] for chain in chains]))
+    optimizer.iterations_done = sum(chain["iterations"] for chain in chains)
+    return best, best_cost
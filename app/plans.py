@@ -0,0 +1,52 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from .database import session_scope
+from .matrix import TravelMatrix
+from .models import SavedPlan
+
+PLAN_MATRIX_SLOTS = int(os.environ.get("PLAN_MATRIX_SLOTS", "4"))
+
+_matrices: "OrderedDict[str, TravelMatrix]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def plan_key(depot: Tuple[float, float], vehicle_ids: List[int]) -> str:
+    return f"{depot[0]:.6f},{depot[1]:.6f}:{','.join(str(v) for v in sorted(vehicle_ids))}"
+
+
+def load_plan(key: str) -> Optional[Dict[int, List[int]]]:
+    with session_scope() as session:
+        plan = session.get(SavedPlan, key)
+        if plan is None:
+            return None
+        return {int(vehicle_id): stops for vehicle_id, stops in json.loads(plan.routes).items()}
+
+
+def save_plan(key: str, routes: Dict[int, List[int]], cost: float):
+    with session_scope() as session:
+        plan = session.get(SavedPlan, key)
+        if plan is None:
+            plan = SavedPlan(key=key)
+            session.add(plan)
+        plan.routes = json.dumps(routes)
+        plan.cost = cost
+        session.commit()
+
+
+def recall_matrix(key: str) -> Optional[TravelMatrix]:
+    with _lock:
+        matrix = _matrices.get(key)
+        if matrix is not None:
+            _matrices.move_to_end(key)
+        return matrix
+
+
+def remember_matrix(key: str, matrix: TravelMatrix):
+    with _lock:
+        _matrices[key] = matrix
+        _matrices.move_to_end(key)
+        while len(_matrices) > PLAN_MATRIX_SLOTS:
+            _matrices.popitem(last=False)
@@ -1,31 +1,54 @@
-import io
+import gzip
+import itertools
 import json
 import math
-from contextlib import contextmanager
-from flask import Blueprint, jsonify, request, render_template
-import pandas as pd
-from .database import get_session
-from .models import Vehicle, Order, Depot
+import zlib
+from flask import Blueprint, Response, jsonify, request, render_template, stream_with_context
+from .database import session_scope
+from .models import Vehicle, Order, Depot, bump_revision, get_revision
 from .geocode import geocode_address
-from .graph import get_graph
-from .optimizer import Request, VehicleProfile, CVRPTWOptimizer, select_vehicle_set
+from .geometry import route_geometry
+from .graph import get_compact_graph
+from .jobs import cancel_job, get_job, get_job_result, job_events, submit_job
+from .metrics import render_prometheus
+from .batch import load_batch, solve_batch
+from .solver import SolveOptions, load_problem
 
 api_bp = Blueprint("api", __name__)
 pages_bp = Blueprint("pages", __name__)
 
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
 
 @pages_bp.route("/")
 def index():
     return render_template("index.html")
 
 
-@contextmanager
-def session_scope():
-    session = get_session()
-    try:
-        yield session
-    finally:
-        session.close()
+@api_bp.after_request
+def compress_response(response: Response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "")
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    etag, _ = response.get_etag()
+    if etag:
+        # the compressed body is a different representation of the same revision
+        response.set_etag(etag, weak=True)
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 def serialize_order(order: Order):
@@ -51,6 +74,45 @@ def serialize_vehicle(vehicle: Vehicle):
     }
 
 
+def float_arg(name: str):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a number")
+    return number
+
+
+def list_response(session, model, table: str, serialize, query):
+    revision = get_revision(session, table)
+    etag = f"{table}-{revision}-{zlib.crc32(request.query_string):08x}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"error": "limit and after must be integers"}), 400
+    fields = request.args.get("fields")
+    fields = {"id", *fields.split(",")} if fields else None
+    rows = query.filter(model.id > after).order_by(model.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [serialize(row) for row in rows]
+    if fields:
+        items = [{key: value for key, value in item.items() if key in fields} for item in items]
+    response = jsonify({"items": items, "next_after": rows[-1].id if has_more else None, "revision": revision})
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @api_bp.route("/vehicles", methods=["GET", "POST"])
 def vehicles_handler():
     with session_scope() as session:
@@ -58,9 +120,13 @@ def vehicles_handler():
             data = request.json
             vehicle = Vehicle(name=data["name"], capacity=float(data["capacity"]), active=True)
             session.add(vehicle)
+            bump_revision(session, "vehicles")
             session.commit()
-        vehicles = session.query(Vehicle).all()
-        return jsonify([serialize_vehicle(v) for v in vehicles])
+            return jsonify(serialize_vehicle(vehicle)), 201
+        query = session.query(Vehicle)
+        if request.args.get("active") is not None:
+            query = query.filter(Vehicle.active.is_(request.args.get("active") in ("1", "true")))
+        return list_response(session, Vehicle, "vehicles", serialize_vehicle, query)
 
 
 @api_bp.route("/vehicles/<int:vehicle_id>", methods=["PUT", "DELETE"])
@@ -71,6 +137,7 @@ def vehicle_detail(vehicle_id):
             return jsonify({"error": "vehicle not found"}), 404
         if request.method == "DELETE":
             session.delete(vehicle)
+            bump_revision(session, "vehicles")
             session.commit()
             return jsonify({"status": "deleted"})
         data = request.json
@@ -79,6 +146,7 @@ def vehicle_detail(vehicle_id):
             vehicle.capacity = float(data["capacity"])
         if "active" in data:
             vehicle.active = bool(data["active"])
+        bump_revision(session, "vehicles")
         session.commit()
         return jsonify(serialize_vehicle(vehicle))
 
@@ -108,9 +176,27 @@ def orders_handler():
                 window_end=float(data.get("window_end")) if data.get("window_end") else None,
             )
             session.add(order)
+            bump_revision(session, "orders")
             session.commit()
-        orders = session.query(Order).all()
-        return jsonify([serialize_order(o) for o in orders])
+            return jsonify(serialize_order(order)), 201
+        query = session.query(Order)
+        bbox = request.args.get("bbox")
+        if bbox:
+            try:
+                min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+            except ValueError:
+                return jsonify({"error": "bbox must be min_lon,min_lat,max_lon,max_lat"}), 400
+            query = query.filter(Order.latitude.between(min_lat, max_lat), Order.longitude.between(min_lon, max_lon))
+        try:
+            window_from = float_arg("window_from")
+            window_to = float_arg("window_to")
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        if window_from is not None:
+            query = query.filter((Order.window_end.is_(None)) | (Order.window_end >= window_from))
+        if window_to is not None:
+            query = query.filter((Order.window_start.is_(None)) | (Order.window_start <= window_to))
+        return list_response(session, Order, "orders", serialize_order, query)
 
 
 @api_bp.route("/orders/<int:order_id>", methods=["PUT", "DELETE"])
@@ -121,6 +207,7 @@ def order_detail(order_id):
             return jsonify({"error": "order not found"}), 404
         if request.method == "DELETE":
             session.delete(order)
+            bump_revision(session, "orders")
             session.commit()
             return jsonify({"status": "deleted"})
         data = request.json
@@ -131,137 +218,230 @@ def order_detail(order_id):
         if "latitude" in data and "longitude" in data:
             order.latitude = float(data["latitude"])
             order.longitude = float(data["longitude"])
+            order.node_id = None
         if "volume" in data:
             order.volume = float(data["volume"])
         if "window_start" in data:
             order.window_start = float(data["window_start"]) if data["window_start"] is not None else None
         if "window_end" in data:
             order.window_end = float(data["window_end"]) if data["window_end"] is not None else None
+        bump_revision(session, "orders")
         session.commit()
         return jsonify(serialize_order(order))
 
 
 @api_bp.route("/orders/import", methods=["POST"])
 def import_orders():
+    import pandas as pd
+    from .importer import REQUIRED_COLUMNS, import_frames, read_frames
+
     file = request.files.get("file")
     if not file:
         return jsonify({"error": "file required"}), 400
-    content = file.read()
-    stream = io.BytesIO(content)
-    filename = file.filename or ""
-    if filename.lower().endswith(".csv"):
-        df = pd.read_csv(stream)
-    else:
-        df = pd.read_excel(stream)
-    required = {"id", "volume"}
-    if not required.issubset(set(df.columns)):
+    try:
+        frames = read_frames(file)
+        first = next(frames)
+    except (StopIteration, pd.errors.EmptyDataError):
+        return jsonify({"error": "file is empty"}), 400
+    except (pd.errors.ParserError, UnicodeDecodeError, ValueError) as exc:
+        return jsonify({"error": f"unreadable file: {exc}"}), 400
+    if not REQUIRED_COLUMNS.issubset(set(first.columns)):
         return jsonify({"error": "columns id and volume required"}), 400
-    created = []
     with session_scope() as session:
-        for _, row in df.iterrows():
-            lat = row.get("lat")
-            lon = row.get("lon")
-            address = row.get("address") if not (isinstance(row.get("address"), float) and math.isnan(row.get("address"))) else None
-            if (pd.isna(lat) or pd.isna(lon)) and address:
-                coords = geocode_address(address)
-                if coords:
-                    lat, lon = coords
-            if pd.isna(lat) or pd.isna(lon):
-                continue
-            order = Order(
-                external_id=str(row.get("id")),
-                address=address,
-                latitude=float(lat),
-                longitude=float(lon),
-                volume=float(row.get("volume", 0)),
-                window_start=float(row.get("window_start")) if "window_start" in row and not pd.isna(row.get("window_start")) else None,
-                window_end=float(row.get("window_end")) if "window_end" in row and not pd.isna(row.get("window_end")) else None,
-            )
-            session.add(order)
-            session.flush()
-            created.append(order)
-        session.commit()
-    return jsonify([serialize_order(o) for o in created])
+        summary = import_frames(session, itertools.chain([first], frames))
+    return jsonify(summary)
+
+
+def serialize_depot(depot: Depot):
+    return {
+        "id": depot.id,
+        "name": depot.name,
+        "latitude": depot.latitude,
+        "longitude": depot.longitude,
+        "address": depot.address,
+    }
+
+
+def depot_coordinates(data):
+    lat = data.get("latitude")
+    lon = data.get("longitude")
+    address = data.get("address")
+    if lat is None or lon is None:
+        if not address:
+            return None, "coordinates or address required"
+        coords = geocode_address(address)
+        if not coords:
+            return None, "could not geocode"
+        lat, lon = coords
+    return (float(lat), float(lon)), None
 
 
 @api_bp.route("/depot", methods=["GET", "POST"])
 def depot_handler():
     with session_scope() as session:
-        depot = session.query(Depot).first()
+        depot = session.query(Depot).order_by(Depot.id).first()
         if request.method == "GET":
             if not depot:
                 return jsonify(None)
-            return jsonify({"latitude": depot.latitude, "longitude": depot.longitude, "address": depot.address})
+            return jsonify(serialize_depot(depot))
         data = request.json
-        lat = data.get("latitude")
-        lon = data.get("longitude")
-        address = data.get("address")
-        if lat is None or lon is None:
-            if not address:
-                return jsonify({"error": "coordinates or address required"}), 400
-            coords = geocode_address(address)
-            if not coords:
-                return jsonify({"error": "could not geocode"}), 400
-            lat, lon = coords
+        coords, error = depot_coordinates(data)
+        if error:
+            return jsonify({"error": error}), 400
         if depot:
-            depot.latitude = float(lat)
-            depot.longitude = float(lon)
-            depot.address = address
+            depot.latitude, depot.longitude = coords
+            depot.node_id = None
+            depot.address = data.get("address")
         else:
-            depot = Depot(latitude=float(lat), longitude=float(lon), address=address)
+            depot = Depot(latitude=coords[0], longitude=coords[1], address=data.get("address"))
             session.add(depot)
+        bump_revision(session, "depots")
+        session.commit()
+        return jsonify(serialize_depot(depot))
+
+
+@api_bp.route("/depots", methods=["GET", "POST"])
+def depots_handler():
+    with session_scope() as session:
+        if request.method == "POST":
+            data = request.json
+            coords, error = depot_coordinates(data)
+            if error:
+                return jsonify({"error": error}), 400
+            depot = Depot(name=data.get("name"), latitude=coords[0], longitude=coords[1], address=data.get("address"))
+            session.add(depot)
+            bump_revision(session, "depots")
+            session.commit()
+            return jsonify(serialize_depot(depot)), 201
+        return list_response(session, Depot, "depots", serialize_depot, session.query(Depot))
+
+
+@api_bp.route("/depots/<int:depot_id>", methods=["PUT", "DELETE"])
+def depot_detail(depot_id):
+    with session_scope() as session:
+        depot = session.get(Depot, depot_id)
+        if not depot:
+            return jsonify({"error": "depot not found"}), 404
+        if request.method == "DELETE":
+            session.delete(depot)
+            bump_revision(session, "depots")
+            session.commit()
+            return jsonify({"status": "deleted"})
+        data = request.json
+        depot.name = data.get("name", depot.name)
+        if "address" in data:
+            depot.address = data["address"]
+        if "latitude" in data and "longitude" in data:
+            depot.latitude = float(data["latitude"])
+            depot.longitude = float(data["longitude"])
+            depot.node_id = None
+        bump_revision(session, "depots")
         session.commit()
-        return jsonify({"latitude": depot.latitude, "longitude": depot.longitude, "address": depot.address})
+        return jsonify(serialize_depot(depot))
 
 
 @api_bp.route("/solve", methods=["POST"])
 def solve():
     payload = request.json or {}
-    force_all = bool(payload.get("force_all", False))
-    active_vehicle_ids = payload.get("vehicles")
+    try:
+        options = SolveOptions.from_payload(payload)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
     with session_scope() as session:
-        depot = session.query(Depot).first()
-        if not depot:
-            return jsonify({"error": "depot is required"}), 400
-        orders = session.query(Order).all()
-        if not orders:
-            return jsonify({"error": "no orders"}), 400
-        vehicles = session.query(Vehicle).filter(Vehicle.active.is_(True)).all()
-        if not vehicles:
-            return jsonify({"error": "no active vehicles"}), 400
-        if active_vehicle_ids:
-            vehicles = [v for v in vehicles if v.id in active_vehicle_ids]
-        if not vehicles:
-            return jsonify({"error": "no selected vehicles"}), 400
-        total_demand = sum(o.volume for o in orders)
-        vehicle_profiles = [VehicleProfile(id=v.id, name=v.name, capacity=v.capacity) for v in vehicles]
-        vehicle_set = select_vehicle_set(vehicle_profiles, total_demand, force_all)
-        requests = [
-            Request(
-                id=o.id,
-                external_id=o.external_id,
-                volume=o.volume,
-                window=(o.window_start or 0, o.window_end or float("inf")),
-                location=(o.latitude, o.longitude),
-            )
-            for o in orders
-        ]
-        optimizer = CVRPTWOptimizer(depot=(depot.latitude, depot.longitude), requests=requests, vehicles=vehicle_set)
-        routes = optimizer.optimize()
-        response = []
-        for route in routes:
-            response.append(
-                {
-                    "vehicle": {"id": route.vehicle.id, "name": route.vehicle.name, "capacity": route.vehicle.capacity},
-                    "stops": route.stops,
-                    "distance_km": route.distance / 1000,
-                    "travel_time_min": route.travel_time / 60,
-                    "geometry": route.geometry,
-                }
-            )
-        return jsonify({"routes": response})
+        problem, error = load_problem(session, payload, options)
+    if error:
+        return jsonify({"error": error}), 400
+    job_id = submit_job(problem, options)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+
+@api_bp.route("/solve/batch", methods=["POST"])
+def solve_batch_handler():
+    payload = request.json or {}
+    with session_scope() as session:
+        scenarios, error = load_batch(session, payload)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        options = SolveOptions.from_payload({key: value for key, value in payload.items() if key != "scenarios"})
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    budget = None
+    if all(scenario.options.iterations for scenario in scenarios):
+        budget = sum(scenario.options.iterations for scenario in scenarios)
+    job_id = submit_job(scenarios, options, solve_batch, budget)
+    return jsonify({"job_id": job_id, "status": "queued", "scenarios": len(scenarios)}), 202
+
+
+@api_bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+
+@api_bp.route("/jobs/<job_id>/events")
+def job_stream(job_id):
+    if get_job(job_id) is None:
+        return jsonify({"error": "job not found"}), 404
+    return Response(
+        stream_with_context(job_events(job_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_bp.route("/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    job = cancel_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+
+@api_bp.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    result = get_job_result(job_id)
+    if result is None:
+        return jsonify({"error": "job has no result yet", "status": job["status"]}), 409
+    return Response(result, mimetype="application/json")
+
+
+@api_bp.route("/jobs/<job_id>/routes/<int:index>/geometry")
+def job_route_geometry(job_id, index):
+    result = get_job_result(job_id)
+    if result is None:
+        return jsonify({"error": "job has no result yet"}), 404
+    zoom = request.args.get("zoom")
+    try:
+        zoom = int(zoom) if zoom not in (None, "") else None
+    except ValueError:
+        return jsonify({"error": "zoom must be an integer"}), 400
+    result = json.loads(result)
+    if "scenarios" in result:
+        # batch jobs keep their routes per scenario
+        try:
+            scenario = int(request.args["scenario"])
+        except (KeyError, ValueError):
+            return jsonify({"error": "scenario index is required for batch jobs"}), 400
+        if not 0 <= scenario < len(result["scenarios"]):
+            return jsonify({"error": "scenario not found"}), 404
+        result = result["scenarios"][scenario]
+    geometry = route_geometry(result, index, zoom)
+    if geometry is None:
+        return jsonify({"error": "route not found"}), 404
+    return jsonify(geometry)
+
+
+@api_bp.route("/metrics")
+def metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 @api_bp.route("/health")
 def health():
-    return jsonify({"status": "ok", "graph_loaded": bool(get_graph())})
+    return jsonify({"status": "ok", "graph_loaded": get_compact_graph().size > 0})
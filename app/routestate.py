@@ -0,0 +1,135 @@
+from typing import List, Optional
+import numpy as np
+
+LATE_PENALTY = 1e6
+
+
+class RouteState:
+    def __init__(self, optimizer, stops: List[int], capacity: float):
+        self.optimizer = optimizer
+        self.stops = list(stops)
+        self.capacity = capacity
+        self.refresh()
+
+    def refresh(self):
+        opt = self.optimizer
+        stops = np.asarray(self.stops, dtype=np.int64)
+        nodes = np.concatenate(([opt.depot_index], opt.matrix_index[stops], [opt.depot_index]))
+        self.opens = np.concatenate(([0.0], opt.window_start[stops], [0.0]))
+        self.closes = np.concatenate(([np.inf], opt.window_end[stops], [np.inf]))
+        buckets = opt.matrix.buckets
+        legs = opt.matrix.travel_time[nodes[:-1], nodes[1:]].tolist() if buckets is None else None
+        opens = self.opens.tolist()
+        closes = self.closes.tolist()
+        arrival = [0.0] * len(nodes)
+        start = [0.0] * len(nodes)
+        late = [False] * len(nodes)
+        time = 0.0
+        for k in range(1, len(nodes)):
+            time += legs[k - 1] if buckets is None else buckets.leg_time(nodes[k - 1], nodes[k], time)
+            arrival[k] = time
+            if time < opens[k]:
+                time = opens[k]
+            start[k] = time
+            late[k] = time > closes[k]
+        self.nodes = nodes
+        self.arrival = np.array(arrival)
+        self.start = np.array(start)
+        self.late = np.array(late)
+        # lates among positions k..end, used to compare against a re-simulated suffix
+        self.late_suffix = np.cumsum(self.late[::-1])[::-1]
+        # forward slack: the largest arrival delay at k that creates no new late stop from k onwards
+        wait = self.start - self.arrival
+        margin = np.where(self.late, np.inf, self.closes - self.start)
+        waited = np.cumsum(wait)
+        self.slack = np.minimum.accumulate((waited + margin)[::-1])[::-1] - np.concatenate(([0.0], waited[:-1]))
+        self.load = float(opt.volumes[stops].sum())
+        self.distance = float(opt.matrix.distance[nodes[:-1], nodes[1:]].sum())
+        self.lates = int(self.late.sum())
+
+    @property
+    def cost(self) -> float:
+        return self.distance + LATE_PENALTY * self.lates
+
+    def suffix_lates(self, position: int, arrival: float) -> int:
+        matrix = self.optimizer.matrix
+        nodes = self.nodes
+        lates = 0
+        time = arrival
+        for k in range(position, len(nodes)):
+            if k > position:
+                time += matrix.leg_time(nodes[k - 1], nodes[k], time)
+            if time < self.opens[k]:
+                time = self.opens[k]
+            if time > self.closes[k]:
+                lates += 1
+        return lates
+
+    def allowed(self, positions: np.ndarray, everywhere: Optional[np.ndarray] = None) -> np.ndarray:
+        neighbours = self.optimizer.neighbours
+        if neighbours is None or not self.stops or (everywhere is not None and everywhere.all()):
+            return np.ones((len(positions), len(self.nodes) - 1), dtype=bool)
+        # granular positions: the stop before or after the gap is one of the request's nearest neighbours
+        near = neighbours[np.ix_(positions, self.stops)]
+        allowed = np.zeros((len(positions), len(self.nodes) - 1), dtype=bool)
+        allowed[:, 1:] |= near
+        allowed[:, :-1] |= near
+        if everywhere is not None:
+            allowed |= everywhere[:, None]
+        return allowed
+
+    def insertion_matrix(
+        self,
+        positions: np.ndarray,
+        everywhere: Optional[np.ndarray] = None,
+        exact: bool = True,
+    ) -> np.ndarray:
+        opt = self.optimizer
+        positions = np.asarray(positions, dtype=np.int64)
+        costs = np.full((len(positions), len(self.nodes) - 1), np.inf)
+        fits = self.load + opt.volumes[positions] <= self.capacity
+        if not fits.any():
+            return costs
+        rows, gaps = np.nonzero(fits[:, None] & self.allowed(positions, everywhere))
+        if not rows.size:
+            return costs
+        pos = positions[rows]
+        index = opt.matrix_index[pos]
+        distance = opt.matrix.distance
+        before = self.nodes[gaps]
+        after = self.nodes[gaps + 1]
+        added = distance[before, index] + distance[index, after] - distance[before, after]
+        departure = self.start[gaps]
+        start = np.maximum(departure + opt.matrix.leg_times(before, index, departure), opt.window_start[pos])
+        new_lates = (start > opt.window_end[pos]).astype(np.float64)
+        arrival = start + opt.matrix.leg_times(index, after, start)
+        delay = arrival - self.arrival[gaps + 1]
+        # with time-dependent legs the slack test is only an estimate: a delay can push a later leg into a
+        # slower hour; solution_cost re-simulates routes exactly, so only the choice of insertion is affected
+        uncertain = (delay > self.slack[gaps + 1]) | ((delay < 0) & (self.late_suffix[gaps + 1] > 0))
+        if exact:
+            for i in np.flatnonzero(uncertain):
+                new_lates[i] += self.suffix_lates(gaps[i] + 1, arrival[i]) - self.late_suffix[gaps[i] + 1]
+        else:
+            # enough to tell on-time insertions apart: anything the slack test cannot clear counts as one late
+            new_lates[uncertain] += 1
+        block = added + LATE_PENALTY * new_lates
+        # legs to unreachable nodes give inf - inf; treat those positions as unusable
+        block[np.isnan(block)] = np.inf
+        costs[rows, gaps] = block
+        return costs
+
+    def insertion_costs(self, pos: int, everywhere: bool = False) -> Optional[np.ndarray]:
+        if self.load + self.optimizer.volumes[pos] > self.capacity:
+            return None
+        return self.insertion_matrix(np.array([pos]), np.array([everywhere]))[0]
+
+    def removal_gains(self) -> np.ndarray:
+        distance = self.optimizer.matrix.distance
+        nodes = self.nodes
+        saved = distance[nodes[:-2], nodes[1:-1]] + distance[nodes[1:-1], nodes[2:]] - distance[nodes[:-2], nodes[2:]]
+        return saved + LATE_PENALTY * self.late[1:-1]
+
+    def insert(self, position: int, pos: int):
+        self.stops.insert(position, pos)
+        self.refresh()
@@ -0,0 +1,269 @@
+import cProfile
+import math
+import pstats
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+from .costs import COST_PROVIDERS, CostProvider, make_cost_provider, matrix_file_path
+from .decompose import DECOMPOSE_METHODS
+from .graph import get_compact_graph, resolve_nodes
+from .metrics import timer
+from .models import Vehicle, Order, Depot
+from .optimizer import Request, VehicleProfile, CVRPTWOptimizer, select_vehicle_set
+from .plans import load_plan, plan_key, recall_matrix, remember_matrix, save_plan
+from .traffic import SHIFT_START_HOUR, get_speed_profile, time_buckets
+
+POLISH_ITERATIONS = 50
+# a warm start is already close to the last plan, so the polish only reshuffles small neighbourhoods
+POLISH_FRACTION = (0.02, 0.06)
+TRACE_POINTS = 500
+PROFILE_LINES = 40
+GRANULAR_NEIGHBOURS = int(os.environ.get("GRANULAR_NEIGHBOURS", "30"))
+
+
+@dataclass
+class Problem:
+    depot: Tuple[float, float]
+    requests: List[Request]
+    vehicles: List[VehicleProfile]
+    node_ids: Optional[List[int]] = None
+    fleet: Optional[List[int]] = None
+
+
+def worker_count(payload: Dict, name: str) -> Optional[int]:
+    value = payload.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a positive integer") from None
+    if count < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return min(count, os.cpu_count() or 1)
+
+
+def neighbour_count(payload: Dict) -> int:
+    value = payload.get("neighbours")
+    if value in (None, ""):
+        return GRANULAR_NEIGHBOURS
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("neighbours must be a non-negative integer (0 turns the lists off)") from None
+    if count < 0:
+        raise ValueError("neighbours must be a non-negative integer (0 turns the lists off)")
+    return count
+
+
+@dataclass
+class SolveOptions:
+    iterations: Optional[int] = 200
+    time_limit: Optional[float] = None
+    workers: int = 1
+    matrix_workers: Optional[int] = None
+    warm_start: bool = False
+    costs: str = "graph"
+    speed_kmh: Optional[float] = None
+    matrix_file: Optional[str] = None
+    profile: bool = False
+    time_dependent: bool = False
+    shift_start: float = SHIFT_START_HOUR
+    decompose: Optional[str] = None
+    cluster_size: Optional[int] = None
+    neighbours: int = GRANULAR_NEIGHBOURS
+
+    @classmethod
+    def from_payload(cls, payload: Dict) -> "SolveOptions":
+        time_limit = float(payload["time_limit"]) if payload.get("time_limit") else None
+        warm_start = bool(payload.get("warm_start", False))
+        default_iterations = POLISH_ITERATIONS if warm_start else 200
+        return cls(
+            iterations=int(payload["iterations"]) if payload.get("iterations") else (None if time_limit else default_iterations),
+            time_limit=time_limit,
+            workers=worker_count(payload, "workers") or 1,
+            matrix_workers=worker_count(payload, "matrix_workers"),
+            warm_start=warm_start,
+            costs=payload.get("costs") or "graph",
+            speed_kmh=float(payload["speed_kmh"]) if payload.get("speed_kmh") else None,
+            matrix_file=payload.get("matrix_file"),
+            profile=bool(payload.get("profile", False)),
+            time_dependent=bool(payload.get("time_dependent", False)),
+            shift_start=float(payload["shift_start"]) if payload.get("shift_start") is not None else SHIFT_START_HOUR,
+            decompose=payload.get("decompose") or None,
+            cluster_size=int(payload["cluster_size"]) if payload.get("cluster_size") else None,
+            neighbours=neighbour_count(payload),
+        )
+
+    def cost_provider(self) -> CostProvider:
+        return make_cost_provider(self.costs, self.speed_kmh, self.matrix_file)
+
+
+def load_problem(session, payload: Dict, options: SolveOptions) -> Tuple[Optional[Problem], Optional[str]]:
+    if options.costs not in COST_PROVIDERS:
+        return None, f"costs must be one of {', '.join(COST_PROVIDERS)}"
+    if options.time_dependent and options.costs != "graph":
+        return None, "time_dependent needs the graph costs"
+    if options.decompose is not None and options.decompose not in DECOMPOSE_METHODS:
+        return None, f"decompose must be one of {', '.join(DECOMPOSE_METHODS)}"
+    if options.costs == "matrix" and not (options.matrix_file and os.path.exists(matrix_file_path(options.matrix_file))):
+        return None, "matrix file not found"
+    force_all = bool(payload.get("force_all", False))
+    active_vehicle_ids = payload.get("vehicles")
+    depot_id = payload.get("depot")
+    if depot_id is not None:
+        try:
+            depot_id = int(depot_id)
+        except (TypeError, ValueError):
+            return None, "depot must be an integer"
+    depot = session.get(Depot, depot_id) if depot_id is not None else session.query(Depot).order_by(Depot.id).first()
+    if not depot:
+        return None, "depot not found" if depot_id is not None else "depot is required"
+    orders = session.query(Order).all()
+    if not orders:
+        return None, "no orders"
+    vehicles = session.query(Vehicle).filter(Vehicle.active.is_(True)).all()
+    if not vehicles:
+        return None, "no active vehicles"
+    if active_vehicle_ids:
+        vehicles = [v for v in vehicles if v.id in active_vehicle_ids]
+    if not vehicles:
+        return None, "no selected vehicles"
+    total_demand = sum(o.volume for o in orders)
+    vehicle_profiles = [VehicleProfile(id=v.id, name=v.name, capacity=v.capacity) for v in vehicles]
+    requests = [
+        Request(
+            id=o.id,
+            external_id=o.external_id,
+            volume=o.volume,
+            window=(o.window_start or 0, o.window_end or float("inf")),
+            location=(o.latitude, o.longitude),
+        )
+        for o in orders
+    ]
+    return Problem(
+        depot=(depot.latitude, depot.longitude),
+        requests=requests,
+        vehicles=select_vehicle_set(vehicle_profiles, total_demand, force_all),
+        node_ids=snap_rows(session, [depot, *orders]) if options.costs == "graph" else None,
+        fleet=[v.id for v in vehicles],
+    ), None
+
+
+def snap_rows(session, rows) -> List[int]:
+    nodes = resolve_nodes([(row.latitude, row.longitude) for row in rows], [row.node_id for row in rows])
+    node_ids = get_compact_graph().node_ids[nodes].tolist()
+    changed = False
+    for row, node_id in zip(rows, node_ids):
+        if row.node_id != node_id:
+            row.node_id = node_id
+            changed = True
+    if changed:
+        session.commit()
+    return node_ids
+
+
+def cost_trace(trace: List[Tuple[int, float, float]]) -> Dict[str, List[float]]:
+    step = max(1, math.ceil(len(trace) / TRACE_POINTS))
+    points = trace[step - 1::step]
+    if trace and points[-1] != trace[-1]:
+        points.append(trace[-1])
+    return {
+        "iteration": [point[0] for point in points],
+        "current": [point[1] for point in points],
+        "best": [point[2] for point in points],
+    }
+
+
+def profile_summary(profiler: cProfile.Profile) -> List[Dict]:
+    entries = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "total_seconds": total,
+            "cumulative_seconds": cumulative,
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in entries[:PROFILE_LINES]
+    ]
+
+
+def serialize_route(route) -> Dict:
+    return {
+        "vehicle": {"id": route.vehicle.id, "name": route.vehicle.name, "capacity": route.vehicle.capacity},
+        "stops": route.stops,
+        "distance_km": route.distance / 1000,
+        "travel_time_min": route.travel_time / 60,
+    }
+
+
+def locate_route(entry: Dict, rows: List[int], points: List[Tuple[float, float]], matrix) -> Dict:
+    entry["points"] = [points[row] for row in rows]
+    if matrix.graph is not None:
+        entry["nodes"] = matrix.graph.node_ids[matrix.nodes[rows]].tolist() if rows else []
+    return entry
+
+
+def serialize_unassigned(requests: List[Request], unplaced: List[int]) -> List[Dict]:
+    unplaced = set(unplaced)
+    return [{"id": r.id, "external_id": r.external_id, "volume": r.volume} for r in requests if r.id in unplaced]
+
+
+def solve_problem(problem: Problem, options: SolveOptions, progress: Optional[Callable[[int, float], bool]] = None):
+    if not options.profile:
+        return run_solve(problem, options, progress)
+    profiler = cProfile.Profile()
+    result = profiler.runcall(run_solve, problem, options, progress)
+    result["profile"] = profile_summary(profiler)
+    return result
+
+
+def run_solve(problem: Problem, options: SolveOptions, progress: Optional[Callable[[int, float], bool]] = None):
+    # the vehicles picked for this solve follow the demand, so the plan is kept per depot and fleet
+    key = plan_key(problem.depot, problem.fleet or [v.id for v in problem.vehicles])
+    matrix_key = f"{options.costs}:{key}"
+    with timer("cost_matrix", provider=options.costs) as matrix_timing:
+        matrix = options.cost_provider().matrix(
+            [problem.depot] + [r.location for r in problem.requests],
+            problem.node_ids,
+            options.matrix_workers,
+            recall_matrix(matrix_key) if options.warm_start else None,
+        )
+    remember_matrix(matrix_key, matrix)
+    timings = {"matrix": matrix_timing.seconds}
+    if options.time_dependent:
+        with timer("time_buckets") as buckets_timing:
+            matrix = replace(matrix, buckets=time_buckets(matrix, get_speed_profile(), options.shift_start * 3600, options.matrix_workers))
+        timings["time_buckets"] = buckets_timing.seconds
+    optimizer = CVRPTWOptimizer(
+        depot=problem.depot,
+        requests=problem.requests,
+        vehicles=problem.vehicles,
+        matrix=matrix,
+        neighbours=options.neighbours,
+    )
+    previous = load_plan(key) if options.warm_start else None
+    if previous is not None:
+        optimizer.min_fraction, optimizer.max_fraction = POLISH_FRACTION
+    routes = optimizer.optimize(
+        iterations=options.iterations,
+        time_limit=options.time_limit,
+        workers=options.workers,
+        progress=progress,
+        start=optimizer.warm_solution(previous) if previous is not None else None,
+        decompose=options.decompose,
+        cluster_size=options.cluster_size,
+    )
+    save_plan(key, {route.vehicle.id: route.stops for route in routes}, optimizer.best_cost)
+    points = [problem.depot] + [r.location for r in problem.requests]
+    response = [locate_route(serialize_route(route), route.rows, points, matrix) for route in routes]
+    return {
+        "plan": matrix_key,
+        "routes": response,
+        "unassigned": serialize_unassigned(problem.requests, optimizer.unplaced),
+        "operators": optimizer.operator_summary(),
+        "iterations": optimizer.iterations_done,
+        "warm_start": previous is not None,
+        "timings": {**timings, **optimizer.timings},
+        "trace": cost_trace(optimizer.trace),
+    }
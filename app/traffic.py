@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from .graph import ROAD_CLASSES, CompactGraph
+from .matrix import HOUR, TimeBuckets, TravelMatrix, slowed_travel_times
+
+HOURS = 24
+SPEED_PROFILE_PATH = os.environ.get(
+    "SPEED_PROFILE_PATH", os.path.join(os.path.dirname(__file__), "..", "cache", "speed_profiles.json")
+)
+SHIFT_START_HOUR = float(os.environ.get("SHIFT_START_HOUR", "8"))
+# one slot holds the bucket matrix of one speed factor over one point set
+BUCKET_MATRIX_SLOTS = int(os.environ.get("BUCKET_MATRIX_SLOTS", "8"))
+NIGHT = range(0, 6)
+RUSH = (*range(7, 10), *range(17, 20))
+# travel time multipliers over free flow at night, during the day and in rush hours
+CLASS_FACTORS = {
+    "motorway": (1.0, 1.25, 1.8),
+    "trunk": (1.0, 1.3, 1.9),
+    "primary": (1.0, 1.35, 2.0),
+    "secondary": (1.0, 1.3, 1.7),
+    "tertiary": (1.0, 1.2, 1.4),
+    "local": (1.0, 1.1, 1.2),
+}
+
+
+_bucket_matrices: "OrderedDict[Tuple[bytes, bytes], BucketMatrix]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def default_profile() -> np.ndarray:
+    period = np.ones(HOURS, dtype=np.int64)
+    period[list(NIGHT)] = 0
+    period[list(RUSH)] = 2
+    return np.array([np.take(CLASS_FACTORS[name], period) for name in ROAD_CLASSES], dtype=np.float32)
+
+
+def load_profile(path: str = SPEED_PROFILE_PATH) -> np.ndarray:
+    profile = default_profile()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fp:
+            overrides = json.load(fp)
+        for name, factors in overrides.items():
+            if name in ROAD_CLASSES and len(factors) == HOURS:
+                profile[ROAD_CLASSES.index(name)] = np.asarray(factors, dtype=np.float32)
+    return profile
+
+
+@lru_cache(maxsize=1)
+def get_speed_profile() -> np.ndarray:
+    return load_profile()
+
+
+@dataclass
+class BucketMatrix:
+    graph: CompactGraph
+    nodes: np.ndarray
+    times: np.ndarray
+
+
+def recall_bucket(graph: CompactGraph, factor: np.ndarray, nodes: np.ndarray) -> Optional[BucketMatrix]:
+    key = factor.tobytes()
+    with _lock:
+        exact = _bucket_matrices.get((key, nodes.tobytes()))
+        if exact is not None and exact.graph is graph:
+            _bucket_matrices.move_to_end((key, nodes.tobytes()))
+            return exact
+        # otherwise the point set under the same factor that shares the most nodes saves the most searches
+        candidates = [entry for (factor_key, _), entry in _bucket_matrices.items() if factor_key == key and entry.graph is graph]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda entry: int(np.isin(nodes, entry.nodes, assume_unique=True).sum()))
+
+
+def remember_bucket(factor: np.ndarray, entry: BucketMatrix):
+    with _lock:
+        key = (factor.tobytes(), entry.nodes.tobytes())
+        _bucket_matrices[key] = entry
+        _bucket_matrices.move_to_end(key)
+        while len(_bucket_matrices) > BUCKET_MATRIX_SLOTS:
+            _bucket_matrices.popitem(last=False)
+
+
+def bucket_matrices(graph: CompactGraph, factors: np.ndarray, nodes: np.ndarray, workers: Optional[int] = None) -> List[np.ndarray]:
+    results: List[Optional[np.ndarray]] = [None] * len(factors)
+    pending = []
+    jobs = []
+    for index, factor in enumerate(factors):
+        previous = recall_bucket(graph, factor, nodes)
+        if previous is not None and np.array_equal(previous.nodes, nodes):
+            results[index] = previous.times
+            continue
+        times = np.empty((len(nodes), len(nodes)), dtype=np.float32)
+        known = np.zeros(len(nodes), dtype=bool)
+        if previous is not None:
+            at = np.minimum(np.searchsorted(previous.nodes, nodes), len(previous.nodes) - 1)
+            known = previous.nodes[at] == nodes
+            times[np.ix_(known, known)] = previous.times[np.ix_(at[known], at[known])]
+        fresh = np.flatnonzero(~known)
+        first_job = len(jobs)
+        if fresh.size:
+            jobs.append((factor, nodes[fresh], nodes, False))
+            if known.any():
+                jobs.append((factor, nodes[fresh], nodes[known], True))
+        pending.append((index, factor, times, known, fresh, first_job))
+    computed = slowed_travel_times(graph, jobs, workers) if jobs else []
+    for index, factor, times, known, fresh, first_job in pending:
+        if fresh.size:
+            times[fresh] = computed[first_job]
+            if known.any():
+                times[np.ix_(known, fresh)] = computed[first_job + 1].T
+        remember_bucket(factor, BucketMatrix(graph=graph, nodes=nodes, times=times))
+        results[index] = times
+    return results
+
+
+def time_buckets(
+    matrix: TravelMatrix,
+    profile: np.ndarray,
+    clock_start: float = SHIFT_START_HOUR * HOUR,
+    workers: Optional[int] = None,
+) -> TimeBuckets:
+    # hours with the same factors for every road class share one matrix
+    factors, hour_bucket = np.unique(profile.T, axis=0, return_inverse=True)
+    unique, inverse = np.unique(matrix.nodes, return_inverse=True)
+    times = np.empty((len(factors), matrix.size, matrix.size), dtype=np.float32)
+    free_flow = np.all(factors == 1.0, axis=1)
+    # the free-flow bucket is a float32 copy of the static matrix, no search is run for it
+    times[free_flow] = matrix.travel_time
+    slowed = np.flatnonzero(~free_flow)
+    for bucket, bucket_times in zip(slowed, bucket_matrices(matrix.graph, factors[slowed], unique, workers)):
+        times[bucket] = bucket_times[np.ix_(inverse, inverse)]
+    return TimeBuckets(hour_bucket=hour_bucket.reshape(-1).astype(np.int8), times=times, clock_start=clock_start)
@@ -0,0 +1,82 @@
+import math
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+from app.matrix import TravelMatrix
+from app.optimizer import Request, VehicleProfile
+
+# Solomon conventions: a 100 x 100 km square, depot in the middle, demand 10-50 per customer
+SQUARE_KM = 100.0
+CAPACITY = 200.0
+SPEED_KMH = 40.0
+HORIZON = 10 * 3600.0
+WINDOW = 3600.0
+KINDS = ("R", "C", "RC")
+COSTS = ("euclidean", "grid")
+
+
+@dataclass
+class Instance:
+    name: str
+    kind: str
+    size: int
+    points: np.ndarray
+    requests: List[Request]
+    vehicles: List[VehicleProfile]
+
+
+def customer_points(kind: str, size: int, rng: np.random.Generator) -> np.ndarray:
+    if kind == "R":
+        return rng.uniform(0, SQUARE_KM, size=(size, 2))
+    clusters = max(size // 10, 1)
+    centers = rng.uniform(10, SQUARE_KM - 10, size=(clusters, 2))
+    clustered = size if kind == "C" else size // 2
+    points = centers[rng.integers(clusters, size=clustered)] + rng.normal(0, 3, size=(clustered, 2))
+    if clustered < size:
+        points = np.vstack([points, rng.uniform(0, SQUARE_KM, size=(size - clustered, 2))])
+    return np.clip(points, 0, SQUARE_KM)
+
+
+def generate_instance(kind: str, size: int, seed: int = 0, window_density: float = 0.5) -> Instance:
+    rng = np.random.default_rng([seed, size, KINDS.index(kind)])
+    depot = np.array([[SQUARE_KM / 2, SQUARE_KM / 2]])
+    customers = customer_points(kind, size, rng)
+    demand = rng.integers(10, 51, size=size).astype(np.float64)
+    reach = np.linalg.norm(customers - depot, axis=1) / SPEED_KMH * 3600
+    centers = rng.uniform(reach + WINDOW / 2, HORIZON - reach - WINDOW / 2)
+    windowed = rng.random(size) < window_density
+    opens = np.where(windowed, np.maximum(centers - WINDOW / 2, 0.0), 0.0)
+    closes = np.where(windowed, centers + WINDOW / 2, HORIZON)
+    requests = [
+        Request(
+            id=i + 1,
+            external_id=f"c{i + 1}",
+            volume=float(demand[i]),
+            window=(float(opens[i]), float(closes[i])),
+            location=(float(customers[i, 1]), float(customers[i, 0])),
+        )
+        for i in range(size)
+    ]
+    fleet = math.ceil(demand.sum() / CAPACITY * 1.5) + 1
+    vehicles = [VehicleProfile(id=v + 1, name=f"v{v + 1}", capacity=CAPACITY) for v in range(fleet)]
+    return Instance(
+        name=f"{kind}{size}-{seed}",
+        kind=kind,
+        size=size,
+        points=np.vstack([depot, customers]),
+        requests=requests,
+        vehicles=vehicles,
+    )
+
+
+def instance_matrix(instance: Instance, costs: str = "euclidean") -> TravelMatrix:
+    delta = instance.points[:, None, :] - instance.points[None, :, :]
+    if costs == "grid":
+        km = np.abs(delta).sum(axis=2)
+    else:
+        km = np.sqrt((delta ** 2).sum(axis=2))
+    return TravelMatrix(
+        nodes=np.arange(len(instance.points), dtype=np.int32),
+        distance=km * 1000,
+        travel_time=km / SPEED_KMH * 3600,
+    )
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import numpy as np
+from app.optimizer import CVRPTWOptimizer, UNASSIGNED_PENALTY
+from app.routestate import LATE_PENALTY
+from .instances import COSTS, KINDS, generate_instance, instance_matrix
+
+BEST_KNOWN_PATH = os.path.join(os.path.dirname(__file__), "best_known.json")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_best_known() -> Dict[str, float]:
+    if not os.path.exists(BEST_KNOWN_PATH):
+        return {}
+    with open(BEST_KNOWN_PATH, "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def run_instance(
+    kind: str,
+    size: int,
+    seed: int,
+    costs: str,
+    iterations: int,
+    time_limit: Optional[float],
+    neighbours: Optional[int] = None,
+) -> Dict:
+    instance = generate_instance(kind, size, seed)
+    started = time.perf_counter()
+    matrix = instance_matrix(instance, costs)
+    matrix_seconds = time.perf_counter() - started
+    optimizer = CVRPTWOptimizer(
+        depot=tuple(instance.points[0]),
+        requests=instance.requests,
+        vehicles=instance.vehicles,
+        matrix=matrix,
+        seed=seed,
+        neighbours=neighbours,
+    )
+    setup_seconds = time.perf_counter() - started - matrix_seconds
+    started = time.perf_counter()
+    initial = optimizer.initial_solution()
+    initial_seconds = time.perf_counter() - started
+    initial_cost = optimizer.solution_cost(initial)
+    started = time.perf_counter()
+    best, best_cost = optimizer.search(initial, iterations, time_limit)
+    search_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    routes = optimizer.materialize(best)
+    materialize_seconds = time.perf_counter() - started
+    states = optimizer.route_states(best)
+    lates = sum(state.lates for state in states)
+    distance = sum(state.distance for state in states)
+    return {
+        "instance": f"{instance.name}-{costs}",
+        "kind": kind,
+        "size": size,
+        "seed": seed,
+        "costs": costs,
+        "vehicles": len(instance.vehicles),
+        "timings": {
+            "matrix": matrix_seconds,
+            "neighbours": setup_seconds,
+            "initial_solution": initial_seconds,
+            "search": search_seconds,
+            "per_iteration": search_seconds / max(optimizer.iterations_done, 1),
+            "materialize": materialize_seconds,
+        },
+        "operators": {
+            op.name: {"calls": op.calls, "mean_ms": op.seconds / op.calls * 1000 if op.calls else None}
+            for op in optimizer.operator_stats.values()
+        },
+        "quality": {
+            "initial_cost": initial_cost,
+            "cost": best_cost,
+            "distance_km": distance / 1000,
+            "late": lates,
+            "unassigned": len(instance.requests) - len(best.stops),
+            "routes_used": sum(1 for route in routes if route.stops),
+            "iterations": optimizer.iterations_done,
+        },
+    }
+
+
+def compare(results: List[Dict], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as fp:
+        baseline = {row["instance"]: row for row in json.load(fp)["results"]}
+    print(f"{'instance':<24}{'cost':>14}{'Δcost %':>10}{'iter ms':>10}{'Δtime %':>10}")
+    for row in results:
+        cost = row["quality"]["cost"]
+        per_iteration = row["timings"]["per_iteration"] * 1000
+        old = baseline.get(row["instance"])
+        if old is None:
+            print(f"{row['instance']:<24}{cost:>14.1f}{'-':>10}{per_iteration:>10.2f}{'-':>10}")
+            continue
+        cost_delta = (cost / old["quality"]["cost"] - 1) * 100
+        time_delta = (row["timings"]["per_iteration"] / old["timings"]["per_iteration"] - 1) * 100
+        print(f"{row['instance']:<24}{cost:>14.1f}{cost_delta:>+10.2f}{per_iteration:>10.2f}{time_delta:>+10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CVRPTWOptimizer on synthetic Solomon-style instances")
+    parser.add_argument("--sizes", default="100,200,500", help="comma separated customer counts, e.g. 100,200,500,1000,2000")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="instance classes: R (random), C (clustered), RC (mixed)")
+    parser.add_argument("--seeds", default="0", help="comma separated instance seeds")
+    parser.add_argument("--costs", choices=COSTS, default="euclidean")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--time-limit", type=float, default=None)
+    parser.add_argument("--neighbours", type=int, default=None, help="granular neighbour list length, off by default")
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    parser.add_argument("--baseline", default=None, help="JSON output of an earlier run to compare against")
+    parser.add_argument("--update-best", action="store_true", help="record improved costs in best_known.json")
+    args = parser.parse_args()
+    if args.neighbours is not None and args.neighbours < 0:
+        parser.error("--neighbours must be non-negative")
+
+    best_known = load_best_known()
+    results = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        for kind in args.kinds.split(","):
+            for seed in (int(value) for value in args.seeds.split(",")):
+                row = run_instance(kind, size, seed, args.costs, args.iterations, args.time_limit, args.neighbours)
+                best = best_known.get(row["instance"])
+                row["quality"]["best_known"] = best
+                row["quality"]["gap_percent"] = (row["quality"]["cost"] / best - 1) * 100 if best else None
+                results.append(row)
+                quality = row["quality"]
+                gap = f"{quality['gap_percent']:+.2f}%" if quality["gap_percent"] is not None else "n/a"
+                print(
+                    f"{row['instance']:<24} cost {quality['cost']:>12.1f}  gap {gap:>8}  "
+                    f"iter {row['timings']['per_iteration'] * 1000:7.2f} ms  "
+                    f"init {row['timings']['initial_solution'] * 1000:7.2f} ms  "
+                    f"materialize {row['timings']['materialize'] * 1000:7.2f} ms"
+                )
+                if args.update_best and (best is None or quality["cost"] < best):
+                    best_known[row["instance"]] = quality["cost"]
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "penalties": {"late": LATE_PENALTY, "unassigned": UNASSIGNED_PENALTY},
+        "params": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+    if args.update_best:
+        with open(BEST_KNOWN_PATH, "w", encoding="utf-8") as fp:
+            json.dump(dict(sorted(best_known.items())), fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
 let depotMarker = null;
 let orderMarkers = {};
 let routeLayers = [];
+let solveStream = null;
+let activeJob = null;
 
 map.on('click', (e) => {
     document.getElementById('depot-lat').value = e.latlng.lat;
@@ -70,9 +72,21 @@ async function addVehicle() {
     loadVehicles();
 }
 
+async function fetchAll(url) {
+    const items = [];
+    let after = 0;
+    while (after !== null) {
+        const sep = url.includes('?') ? '&' : '?';
+        const res = await fetch(`${url}${sep}limit=5000&after=${after}`);
+        const page = await res.json();
+        items.push(...page.items);
+        after = page.next_after;
+    }
+    return items;
+}
+
 async function loadVehicles() {
-    const res = await fetch('/api/vehicles');
-    const data = await res.json();
+    const data = await fetchAll('/api/vehicles');
     const container = document.getElementById('vehicle-list');
     container.innerHTML = '';
     data.forEach(v => {
@@ -94,13 +108,18 @@ async function addOrder() {
         window_start: document.getElementById('order-window-start').value || null,
         window_end: document.getElementById('order-window-end').value || null,
     };
-    await fetch('/api/orders', {
+    const res = await fetch('/api/orders', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(payload)
     });
+    const data = await res.json();
+    if (data.error) {
+        alert(data.error);
+        return;
+    }
     clearOrderForm();
-    loadOrders();
+    renderOrder(data);
 }
 
 function clearOrderForm() {
@@ -108,32 +127,32 @@ function clearOrderForm() {
         .forEach(id => document.getElementById(id).value = '');
 }
 
-async function loadOrders() {
-    const res = await fetch('/api/orders');
-    const data = await res.json();
+function renderOrder(o) {
     const container = document.getElementById('order-list');
-    container.innerHTML = '';
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.innerHTML = `<div><strong>${o.external_id}</strong> · ${o.volume} м³</div>
+    <div class="muted">${o.address || ''}</div>
+    <div class="order-actions">
+        <button data-del="${o.id}">Удалить</button>
+    </div>`;
+    container.appendChild(card);
+    const marker = L.marker([o.latitude, o.longitude]).addTo(map).bindPopup(`Заказ ${o.external_id}`);
+    orderMarkers[o.id] = marker;
+    card.querySelector('button[data-del]').addEventListener('click', async () => {
+        await fetch(`/api/orders/${o.id}`, { method: 'DELETE' });
+        card.remove();
+        marker.remove();
+        delete orderMarkers[o.id];
+    });
+}
+
+async function loadOrders() {
+    const data = await fetchAll('/api/orders?fields=external_id,address,latitude,longitude,volume');
+    document.getElementById('order-list').innerHTML = '';
     Object.values(orderMarkers).forEach(m => m.remove());
     orderMarkers = {};
-    data.forEach(o => {
-        const card = document.createElement('div');
-        card.className = 'card';
-        card.innerHTML = `<div><strong>${o.external_id}</strong> · ${o.volume} м³</div>
-        <div class="muted">${o.address || ''}</div>
-        <div class="order-actions">
-            <button data-del="${o.id}">Удалить</button>
-        </div>`;
-        container.appendChild(card);
-        const marker = L.marker([o.latitude, o.longitude]).addTo(map).bindPopup(`Заказ ${o.external_id}`);
-        orderMarkers[o.id] = marker;
-    });
-    container.querySelectorAll('button[data-del]').forEach(btn => {
-        btn.addEventListener('click', async () => {
-            const id = btn.getAttribute('data-del');
-            await fetch(`/api/orders/${id}`, { method: 'DELETE' });
-            loadOrders();
-        });
-    });
+    data.forEach(renderOrder);
 }
 
 async function importFile() {
@@ -141,11 +160,29 @@ async function importFile() {
     if (!input.files.length) return;
     const form = new FormData();
     form.append('file', input.files[0]);
-    await fetch('/api/orders/import', { method: 'POST', body: form });
+    const res = await fetch('/api/orders/import', { method: 'POST', body: form });
+    const data = await res.json();
     input.value = '';
+    if (data.error) {
+        alert(data.error);
+        return;
+    }
+    showImportSummary(data);
     loadOrders();
 }
 
+function showImportSummary(summary) {
+    const box = document.getElementById('import-summary');
+    const lines = [`Загружено ${summary.created} из ${summary.rows} строк, пропущено ${summary.skipped}`];
+    if (!summary.complete) {
+        lines.push(`Импорт остановлен на строке ${summary.stopped_at_row}, следующие строки не загружены`);
+    }
+    summary.errors.slice(0, 10).forEach(e => lines.push(`Строка ${e.row}: ${e.error}`));
+    if (summary.errors.length > 10) lines.push(`…и ещё ошибок: ${summary.errors.length - 10}`);
+    box.textContent = lines.join('\n');
+    if (!summary.complete) alert(lines[1]);
+}
+
 function readActiveVehicles() {
     const boxes = document.querySelectorAll('input[data-vehicle]');
     return Array.from(boxes).filter(b => b.checked).map(b => parseInt(b.getAttribute('data-vehicle')));
@@ -153,21 +190,93 @@ function readActiveVehicles() {
 
 async function solve() {
     const forceAll = document.getElementById('force-all').checked;
+    const warmStart = document.getElementById('warm-start').checked;
+    const timeDependent = document.getElementById('time-dependent').checked;
     const vehicles = readActiveVehicles();
     const res = await fetch('/api/solve', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ force_all: forceAll, vehicles })
+        body: JSON.stringify({ force_all: forceAll, warm_start: warmStart, time_dependent: timeDependent, vehicles })
     });
     const data = await res.json();
     if (data.error) {
         alert(data.error);
         return;
     }
-    drawRoutes(data.routes);
+    watchJob(data.job_id);
+}
+
+function showProgress(job) {
+    const el = document.getElementById('solve-progress');
+    const cost = job.best_cost != null ? ` · ${(job.best_cost / 1000).toFixed(2)} км` : '';
+    el.textContent = `${job.status} · ${Math.round(job.progress * 100)}% · итерация ${job.iteration}${cost}`;
+}
+
+function watchJob(jobId) {
+    if (solveStream) solveStream.close();
+    activeJob = jobId;
+    document.getElementById('cancel-solve').disabled = false;
+    solveStream = new EventSource(`/api/jobs/${jobId}/events`);
+    solveStream.addEventListener('progress', (e) => showProgress(JSON.parse(e.data)));
+    ['done', 'cancelled', 'failed'].forEach(status => {
+        solveStream.addEventListener(status, async (e) => {
+            const job = JSON.parse(e.data);
+            showProgress(job);
+            solveStream.close();
+            solveStream = null;
+            activeJob = null;
+            document.getElementById('cancel-solve').disabled = true;
+            if (status === 'failed') {
+                alert(job.error || 'solve failed');
+                return;
+            }
+            const res = await fetch(`/api/jobs/${jobId}/result`);
+            if (res.ok) {
+                const data = await res.json();
+                drawRoutes(jobId, data.routes);
+                showUnassigned(data.unassigned || []);
+            }
+        });
+    });
+}
+
+async function cancelSolve() {
+    if (!activeJob) return;
+    await fetch(`/api/jobs/${activeJob}/cancel`, { method: 'POST' });
+}
+
+function decodePolyline(encoded, precision) {
+    const factor = Math.pow(10, precision);
+    const points = [];
+    let index = 0, lat = 0, lon = 0;
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let k = 0; k < 2; k++) {
+            let shift = 0, result = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lon += deltas[1];
+        points.push([lat / factor, lon / factor]);
+    }
+    return points;
 }
 
-function drawRoutes(routes) {
+async function drawRouteGeometry(jobId, idx, color) {
+    const res = await fetch(`/api/jobs/${jobId}/routes/${idx}/geometry?zoom=${map.getZoom()}`);
+    if (!res.ok) return;
+    const data = await res.json();
+    const polyline = L.polyline(decodePolyline(data.polyline, data.precision), { color, weight: 5, opacity: 0.8 });
+    polyline.addTo(map);
+    routeLayers.push(polyline);
+}
+
+function drawRoutes(jobId, routes) {
     routeLayers.forEach(layer => layer.remove());
     routeLayers = [];
     const container = document.getElementById('routes');
@@ -175,13 +284,7 @@ function drawRoutes(routes) {
     const colors = ['#10b981','#3b82f6','#f59e0b','#ef4444','#8b5cf6'];
     routes.forEach((route, idx) => {
         const color = colors[idx % colors.length];
-        const group = L.layerGroup();
-        route.geometry.forEach(segment => {
-            const polyline = L.polyline(segment, { color, weight: 5, opacity: 0.8 });
-            polyline.addTo(group);
-        });
-        group.addTo(map);
-        routeLayers.push(group);
+        if (route.stops.length) drawRouteGeometry(jobId, idx, color);
         const card = document.createElement('div');
         card.className = 'card';
         card.innerHTML = `<div class="route-label">${route.vehicle.name}</div>
@@ -191,11 +294,21 @@ function drawRoutes(routes) {
     });
 }
 
+function showUnassigned(unassigned) {
+    if (!unassigned.length) return;
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.innerHTML = `<div class="route-label">Не распределены: ${unassigned.length}</div>
+    <div>${unassigned.map(u => u.external_id).join(', ')}</div>`;
+    document.getElementById('routes').appendChild(card);
+}
+
 document.getElementById('save-depot').addEventListener('click', saveDepot);
 document.getElementById('add-vehicle').addEventListener('click', addVehicle);
 document.getElementById('add-order').addEventListener('click', addOrder);
 document.getElementById('import-file').addEventListener('click', importFile);
 document.getElementById('run-solve').addEventListener('click', solve);
+document.getElementById('cancel-solve').addEventListener('click', cancelSolve);
 
 updateHealth();
 loadDepot();
@@ -0,0 +1,62 @@
+import pytest
+from geopy.exc import GeocoderTimedOut
+from app import geocode
+
+
+class StubGeocoder:
+    def __init__(self, answers, failures=0):
+        self.answers = answers
+        self.failures = failures
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append(address)
+        if self.failures:
+            self.failures -= 1
+            raise GeocoderTimedOut("timed out")
+        return self.answers.get(address)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(geocode, "CACHE_PATH", str(tmp_path / "missing.json"))
+    store = geocode.GeocodeStore(str(tmp_path / "geocode.db"))
+    monkeypatch.setattr(geocode, "get_geocode_store", lambda: store)
+    monkeypatch.setattr(geocode.time, "sleep", lambda seconds: None)
+    yield store
+    geocode.set_geocoder(None)
+
+
+def test_miss_then_hit(store):
+    stub = StubGeocoder({"Moscow, Tverskaya 1": (55.75, 37.61)})
+    geocode.set_geocoder(stub)
+    first = geocode.geocode_many(["Moscow, Tverskaya 1", "nowhere"], rate_limit=0)
+    assert first == {"Moscow, Tverskaya 1": (55.75, 37.61), "nowhere": None}
+    assert sorted(stub.calls) == ["Moscow, Tverskaya 1", "nowhere"]
+    again = geocode.geocode_many(["moscow tverskaya 1", "nowhere"], rate_limit=0)
+    assert again == {"moscow tverskaya 1": (55.75, 37.61), "nowhere": None}
+    assert len(stub.calls) == 2
+    assert geocode.geocode_address("Moscow, Tverskaya 1") == (55.75, 37.61)
+    assert len(stub.calls) == 2
+
+
+def test_retries_after_timeout(store):
+    stub = StubGeocoder({"Kazan, Baumana 5": (55.79, 49.11)}, failures=2)
+    geocode.set_geocoder(stub)
+    assert geocode.geocode_many(["Kazan, Baumana 5"], rate_limit=0, retries=2) == {"Kazan, Baumana 5": (55.79, 49.11)}
+    assert stub.calls == ["Kazan, Baumana 5"] * 3
+    assert store.get_many(["Kazan, Baumana 5"]) == {"Kazan, Baumana 5": (55.79, 49.11)}
+
+
+def test_exhausted_retries_are_not_cached(store):
+    stub = StubGeocoder({"Kazan, Baumana 5": (55.79, 49.11)}, failures=3)
+    geocode.set_geocoder(stub)
+    assert geocode.geocode_many(["Kazan, Baumana 5"], rate_limit=0, retries=1) == {"Kazan, Baumana 5": None}
+    assert store.get_many(["Kazan, Baumana 5"]) == {}
+    assert geocode.geocode_many(["Kazan, Baumana 5"], rate_limit=0, retries=1) == {"Kazan, Baumana 5": (55.79, 49.11)}
+
+
+def test_limiter_is_shared_per_geocoder(store):
+    stub = StubGeocoder({})
+    assert geocode.get_limiter(stub, 0) is geocode.get_limiter(stub, 0)
+    assert geocode.get_limiter(stub, 0) is not geocode.get_limiter(StubGeocoder({}), 0)
@@ -0,0 +1,136 @@
+import networkx as nx
+import numpy as np
+import pytest
+from app.costcache import CostCache
+from app.graph import compact_graph
+from app.matrix import (
+    extend_matrix,
+    matrix_from_nodes,
+    one_to_all,
+    parallel_one_to_all,
+    slowed_graph,
+    slowed_travel_times,
+    travel_times,
+)
+
+HIGHWAYS = ["primary", "secondary", "residential", "motorway_link", ["tertiary", "residential"]]
+
+
+@pytest.fixture(scope="module")
+def network():
+    rng = np.random.default_rng(7)
+    side = 14
+    graph = nx.MultiDiGraph()
+    for i in range(side * side):
+        graph.add_node(1000 + 7 * i, x=30.4 + 0.002 * (i % side), y=50.4 + 0.002 * (i // side))
+    for i in range(side * side):
+        row, col = divmod(i, side)
+        for j in (i + 1 if col + 1 < side else None, i + side if row + 1 < side else None):
+            if j is None:
+                continue
+            u, v = 1000 + 7 * i, 1000 + 7 * j
+            # most streets run both ways, some are one-way and a few have a slower parallel lane
+            for a, b in ((u, v), (v, u)) if rng.random() < 0.8 else ((u, v),) if rng.random() < 0.5 else ((v, u),):
+                length = rng.uniform(80, 400)
+                highway = HIGHWAYS[rng.integers(len(HIGHWAYS))]
+                graph.add_edge(a, b, length=length, travel_time=length / rng.uniform(5, 20), highway=highway)
+                if rng.random() < 0.1:
+                    graph.add_edge(a, b, length=length * 0.9, travel_time=length / 3, highway="residential")
+    graph.add_edge(1000, 1000, length=5.0, travel_time=1.0, highway="residential")
+    # a driveway out of the network that nothing can reach
+    graph.add_node(999, x=30.399, y=50.399)
+    graph.add_edge(999, 1000, length=150.0, travel_time=20.0, highway="residential")
+    return graph, compact_graph(graph)
+
+
+def reference(graph: nx.MultiDiGraph, compact, nodes):
+    ids = compact.node_ids[nodes]
+    times = np.full((len(ids), len(ids)), np.inf)
+    lengths = np.full((len(ids), len(ids)), np.inf)
+    for i, source in enumerate(ids):
+        dist, paths = nx.single_source_dijkstra(graph, int(source), weight="travel_time")
+        for j, target in enumerate(ids):
+            if int(target) in dist:
+                path = paths[int(target)]
+                times[i, j] = dist[int(target)]
+                lengths[i, j] = sum(
+                    min(graph[u][v].values(), key=lambda edge: edge["travel_time"])["length"] for u, v in zip(path[:-1], path[1:])
+                )
+    return times, lengths
+
+
+def sample(compact, count, seed):
+    rng = np.random.default_rng(seed)
+    return rng.choice(compact.size, count, replace=False).astype(np.int32)
+
+
+def assert_same_matrix(matrix, other):
+    np.testing.assert_array_equal(matrix.nodes, other.nodes)
+    np.testing.assert_allclose(matrix.travel_time, other.travel_time, rtol=1e-12)
+    np.testing.assert_allclose(matrix.distance, other.distance, rtol=1e-12)
+
+
+def test_matrix_matches_networkx(network):
+    graph, compact = network
+    nodes = sample(compact, 25, 1)
+    nodes[5] = compact.index_of([999])[0]
+    matrix = matrix_from_nodes(compact, np.concatenate([nodes, nodes[:3]]), workers=1)
+    times, lengths = reference(graph, compact, nodes)
+    assert np.isinf(times[:, 5]).sum() == 24
+    np.testing.assert_allclose(matrix.travel_time[:25, :25], times, rtol=1e-9)
+    np.testing.assert_allclose(matrix.distance[:25, :25], lengths, rtol=1e-9)
+    np.testing.assert_array_equal(matrix.travel_time[25:], matrix.travel_time[:3])
+    for origin, destination in ((0, 1), (4, 17), (24, 2)):
+        if np.isfinite(times[origin, destination]):
+            source, target = (int(compact.node_ids[nodes[k]]) for k in (origin, destination))
+            path = compact.node_ids[matrix.path(origin, destination)].tolist()
+            assert path == nx.dijkstra_path(graph, source, target, weight="travel_time")
+
+
+def test_parallel_matches_serial(network):
+    _, compact = network
+    nodes = sample(compact, 70, 2)
+    serial = one_to_all(compact, nodes, nodes)
+    parallel = parallel_one_to_all(compact, nodes, nodes, workers=2)
+    np.testing.assert_array_equal(parallel[0], serial[0])
+    np.testing.assert_array_equal(parallel[1], serial[1])
+    for serial_tree, parallel_tree in zip(serial[2], parallel[2]):
+        np.testing.assert_array_equal(parallel_tree.nodes, serial_tree.nodes)
+        np.testing.assert_array_equal(parallel_tree.parents, serial_tree.parents)
+    assert_same_matrix(matrix_from_nodes(compact, nodes, workers=2), matrix_from_nodes(compact, nodes, workers=1))
+
+
+def test_slowed_times_match_serial(network):
+    _, compact = network
+    nodes = sample(compact, 50, 3)
+    factors = [np.linspace(1.0, 2.0, 6), np.full(6, 1.4)]
+    jobs = [(factor, nodes, nodes, reverse) for factor in factors for reverse in (False, True)]
+    parallel = slowed_travel_times(compact, jobs, workers=2)
+    for (factor, sources, targets, reverse), times in zip(jobs, parallel):
+        np.testing.assert_array_equal(times, travel_times(slowed_graph(compact, factor), sources, targets, reverse))
+    forward, backward = parallel[:2]
+    np.testing.assert_allclose(backward.T, forward, rtol=1e-12)
+
+
+def test_extend_matches_fresh_build(network):
+    _, compact = network
+    nodes = sample(compact, 60, 4)
+    previous = matrix_from_nodes(compact, nodes[:40], workers=1)
+    # drop some points, repeat one and add new ones, as a warm start after order edits does
+    current = np.concatenate([nodes[10:40], nodes[12:13], nodes[40:]])
+    extended = extend_matrix(previous, current)
+    fresh = matrix_from_nodes(compact, current, workers=1)
+    assert_same_matrix(extended, fresh)
+    for origin, destination in ((0, 35), (35, 0), (31, 5)):
+        assert extended.path(origin, destination) == fresh.path(origin, destination)
+
+
+def test_cached_build_matches_fresh_build(network, tmp_path):
+    _, compact = network
+    nodes = sample(compact, 50, 5)
+    cache = CostCache("test", str(tmp_path / "costs.db"))
+    matrix_from_nodes(compact, nodes[:30], workers=1, cache=cache)
+    # the second build reads the old block, searches rows of the new nodes and columns for the old rows
+    cached = matrix_from_nodes(compact, nodes, workers=1, cache=cache)
+    assert_same_matrix(cached, matrix_from_nodes(compact, nodes, workers=1))
+    assert_same_matrix(matrix_from_nodes(compact, nodes, workers=1, cache=cache), cached)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from app.matrix import HOUR, TimeBuckets, TravelMatrix
+from app.optimizer import CVRPTWOptimizer, Request, VehicleProfile
+from app.routestate import LATE_PENALTY, RouteState
+
+
+def instance(seed: int, size: int, buckets: bool):
+    rng = np.random.default_rng(seed)
+    coords = rng.uniform(0, 20000, size=(size + 1, 2))
+    distance = np.hypot(*(coords[:, None, :] - coords[None, :, :]).transpose(2, 0, 1))
+    travel_time = distance / 8.0
+    matrix = TravelMatrix(nodes=np.arange(size + 1), distance=distance, travel_time=travel_time)
+    if buckets:
+        hour_bucket = np.zeros(24, dtype=np.int8)
+        hour_bucket[[9, 10, 11]] = 1
+        hour_bucket[[12, 13]] = 2
+        factors = np.array([1.0, 1.8, 1.3])
+        matrix.buckets = TimeBuckets(
+            hour_bucket=hour_bucket,
+            times=(travel_time[None] * factors[:, None, None]).astype(np.float32),
+            clock_start=8 * HOUR,
+        )
+    opens = rng.uniform(0, 4 * HOUR, size=size)
+    requests = [
+        Request(id=i + 1, external_id=str(i + 1), volume=1.0, window=(opens[i], opens[i] + rng.uniform(0.3, 2) * HOUR), location=(0.0, 0.0))
+        for i in range(size)
+    ]
+    optimizer = CVRPTWOptimizer(
+        depot=(0.0, 0.0),
+        requests=requests,
+        vehicles=[VehicleProfile(id=1, name="v", capacity=float(size))],
+        matrix=matrix,
+        seed=seed,
+    )
+    stops = rng.permutation(size)[: rng.integers(1, size - 1)].tolist()
+    return optimizer, stops
+
+
+def full_costs(optimizer: CVRPTWOptimizer, stops, positions) -> np.ndarray:
+    base = optimizer.route_cost(stops)[0]
+    return np.array(
+        [[optimizer.route_cost(stops[:gap] + [pos] + stops[gap:])[0] - base for gap in range(len(stops) + 1)] for pos in positions]
+    )
+
+
+@pytest.mark.parametrize("buckets", [False, True])
+@pytest.mark.parametrize("seed", range(40))
+def test_insertion_matrix_matches_route_cost(seed, buckets):
+    optimizer, stops = instance(seed, 9, buckets)
+    state = RouteState(optimizer, stops, optimizer.capacities[0])
+    positions = np.setdiff1d(np.arange(len(optimizer.requests)), stops)
+    expected = full_costs(optimizer, stops, positions)
+    assert state.cost == pytest.approx(optimizer.route_cost(stops)[0])
+    np.testing.assert_allclose(state.insertion_matrix(positions), expected, rtol=1e-9, atol=1e-6)
+    estimate = state.insertion_matrix(positions, exact=False)
+    # the cheap variant only rounds unclear suffixes to one late stop: what it prices as on time is exact
+    on_time = estimate < LATE_PENALTY / 2
+    np.testing.assert_allclose(estimate[on_time], expected[on_time], rtol=1e-9, atol=1e-6)
+    if not state.lates:
+        np.testing.assert_array_equal(on_time, expected < LATE_PENALTY / 2)